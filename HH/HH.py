@@ -75,34 +75,10 @@ Ix=Ix+StepStrength*(start_cdf- end_cdf)
 # 
 
 # %%
-# Define gating variables 
-alphan = lambda V: .01*(V+55)/(1-np.exp(-.1*(V+55)))
-betan = lambda V: .125*np.exp(-.0125*(V+65))
-alpham = lambda V: .1*(V+40)/(1-np.exp(-.1*(V+40)))
-betam = lambda V: 4*np.exp(-.0556*(V+65))
-alphah = lambda V: .07*np.exp(-.05*(V+65))
-betah = lambda V: 1/(1+np.exp(-.1*(V+35)))
-
-
-# n variable
-ninfty= lambda V: (alphan(V)/(alphan(V)+betan(V)))
-taun= lambda V: (1/(alphan(V)+betan(V)))
-minfty= lambda V: (alpham(V)/(alpham(V)+betam(V)))
-taum= lambda V: (1/(alpham(V)+betam(V)))
-hinfty= lambda V: (alphah(V)/(alphah(V)+betah(V)))
-tauh= lambda V: (1/(alphah(V)+betah(V)))
-
-# Parameters
-Cm=1
-gL= .3
-EL=-54.387
-gK=36
-EK=-77
-gNa=120
-ENa=50
-
-
-# %%
+# Gating variables, parameters (Cm, gL, EL, gK, EK, gNa, ENa) and currents are
+# those of HH_model, the equations above, so the plots below use the same model
+# that euler() simulates
+from HH_model import ninfty, taun, minfty, taum, hinfty, tauh, IK, INa, euler, HHState
 
 # Initial conditions near their fixed points when Ix=0
 V0=-65.0
@@ -110,32 +86,8 @@ n0=ninfty(V0)
 m0=minfty(V0)
 h0=hinfty(V0)
 
-
-# Currents
-IL= lambda V: (-gL*(V-EL))
-IK = lambda n,V: (-gK*n **4*(V-EK))
-INa = lambda m,h,V: (-gNa*m **3*h*(V-ENa))
-
-# Toal ion currents
-Iion = lambda n,m,h,V: IL(V)+IK(n,V)+INa(m,h,V)
-
-# Forward Euler method
-V=np.zeros_like(time)
-n=np.zeros_like(time)
-m=np.zeros_like(time)
-h=np.zeros_like(time)
-V[0]=V0 
-n[0]=n0
-m[0]=m0
-h[0]=h0
-for i in range(len(time)-1): 
-    # Update gating variables
-    n[i+1]=n[i]+dt*((1-n[i])*alphan(V[i])-n[i]*betan(V[i]))
-    m[i+1]=m[i]+dt*((1-m[i])*alpham(V[i])-m[i]*betam(V[i]))
-    h[i+1]=h[i]+dt*((1-h[i])*alphah(V[i])-h[i]*betah(V[i]))
-
-    # Update membrane potential
-    V[i+1]=V[i]+dt*(Iion(n[i],m[i],h[i],V[i])+Ix[i])/Cm
+# Forward Euler method (HH_model.euler; can also resume from a saved HHState)
+V, n, m, h, final_state = euler(Ix, dt, HHState(0, V0, n0, m0, h0))
 
 #dV/dt plots
 dV_dt = np.diff(V)/dt
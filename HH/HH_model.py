@@ -0,0 +1,136 @@
+# %%
+# Hodgkin and Huxley model from HH.py as importable functions, so other scripts can
+# run it without the plotting. Forward Euler, same kinetics and parameters.
+#
+# The Euler loop can be stopped and resumed: a state is the step index plus
+# (V, n, m, h), and euler() continues from any state. Running 0..i, saving the
+# state, and later continuing from it is bit-identical to one run 0..end, so a
+# shared prefix (e.g. the holding period before the step) only has to be simulated
+# once for many branches.
+import os
+import numpy as np
+from collections import namedtuple
+from scipy.stats import norm
+
+# Define gating variables
+alphan = lambda V: .01*(V+55)/(1-np.exp(-.1*(V+55)))
+betan = lambda V: .125*np.exp(-.0125*(V+65))
+alpham = lambda V: .1*(V+40)/(1-np.exp(-.1*(V+40)))
+betam = lambda V: 4*np.exp(-.0556*(V+65))
+alphah = lambda V: .07*np.exp(-.05*(V+65))
+betah = lambda V: 1/(1+np.exp(-.1*(V+35)))
+
+ninfty= lambda V: (alphan(V)/(alphan(V)+betan(V)))
+taun= lambda V: (1/(alphan(V)+betan(V)))
+minfty= lambda V: (alpham(V)/(alpham(V)+betam(V)))
+taum= lambda V: (1/(alpham(V)+betam(V)))
+hinfty= lambda V: (alphah(V)/(alphah(V)+betah(V)))
+tauh= lambda V: (1/(alphah(V)+betah(V)))
+
+SOURCES = [os.path.abspath(__file__)] # files defining the model, for simcache keys
+
+# Parameters
+Cm=1
+gL= .3
+EL=-54.387
+gK=36
+EK=-77
+gNa=120
+ENa=50
+
+# Currents
+IL= lambda V: (-gL*(V-EL))
+IK = lambda n,V: (-gK*n **4*(V-EK))
+INa = lambda m,h,V: (-gNa*m **3*h*(V-ENa))
+Iion = lambda n,m,h,V: IL(V)+IK(n,V)+INa(m,h,V)
+
+# %%
+# protocol position i (index into time/Ix) and the state at that step
+HHState = namedtuple('HHState', ['i', 'V', 'n', 'm', 'h'])
+
+
+def rest_state(V0=-65.0):
+    # initial conditions near their fixed points when Ix=0
+    return HHState(0, V0, ninfty(V0), minfty(V0), hinfty(V0))
+
+
+def smooth_step(time, StepStrength=30, StepTime=None, StepDuration=300, StepWidth=1):
+    # smoothed current step used in HH.py (normal CDF edges), picoAmps
+    if StepTime is None:
+        StepTime = time[-1]/3
+    start_cdf = norm.cdf(time,StepTime,StepWidth)
+    end_cdf = norm.cdf(time,StepTime +StepDuration,StepWidth)
+    return StepStrength*(start_cdf- end_cdf)
+
+
+def euler(Ix, dt, state=None, stop=None):
+    """
+    Forward Euler from state (default: rest at step 0) up to step index stop
+    (default: len(Ix)-1).
+
+    Returns V, n, m, h arrays for steps state.i..stop (both included) and the
+    HHState at stop, which can be passed back in to continue.
+    """
+    if state is None:
+        state = rest_state()
+    if stop is None:
+        stop = len(Ix)-1
+    start = state.i
+    N = stop-start+1
+    V=np.zeros(N)
+    n=np.zeros(N)
+    m=np.zeros(N)
+    h=np.zeros(N)
+    V[0]=state.V
+    n[0]=state.n
+    m[0]=state.m
+    h[0]=state.h
+    for j in range(N-1):
+        i = start+j
+        # Update gating variables
+        n[j+1]=n[j]+dt*((1-n[j])*alphan(V[j])-n[j]*betan(V[j]))
+        m[j+1]=m[j]+dt*((1-m[j])*alpham(V[j])-m[j]*betam(V[j]))
+        h[j+1]=h[j]+dt*((1-h[j])*alphah(V[j])-h[j]*betah(V[j]))
+
+        # Update membrane potential
+        V[j+1]=V[j]+dt*(Iion(n[j],m[j],h[j],V[j])+Ix[i])/Cm
+    return V, n, m, h, HHState(stop, V[-1], n[-1], m[-1], h[-1])
+
+
+def save_state(filename, state):
+    np.savez(filename, **state._asdict())
+
+
+def load_state(filename):
+    s = np.load(filename)
+    return HHState(int(s['i']), *(float(s[k]) for k in HHState._fields[1:]))
+
+
+def run_branches(prefix_Ix, branch_Ix, dt, stop_prefix, state=None):
+    """
+    Simulate prefix_Ix[:stop_prefix+1] once, then continue each current trace in
+    branch_Ix (full-length arrays that agree with prefix_Ix up to stop_prefix) from
+    the saved state. Returns a list of full (V, n, m, h) tuples, one per branch.
+    """
+    pre = euler(prefix_Ix, dt, state, stop_prefix)
+    out = []
+    for Ix in branch_Ix:
+        post = euler(Ix, dt, pre[-1])
+        out.append(tuple(np.concatenate([a[:-1], b]) for a, b in zip(pre[:4], post[:4])))
+    return out
+
+
+def euler_cached(cache, Ix, dt, state=None, features=None):
+    """
+    euler() over the whole of Ix through a simcache.SimCache. features(V, n, m, h)
+    -> dict is evaluated on the new or cached traces. Returns the cache result
+    dict with V, n, m, h and 'features'.
+    """
+    if state is None:
+        state = rest_state()
+    key = cache.key('HH', dict(Cm=Cm, gL=gL, EL=EL, gK=gK, EK=EK, gNa=gNa, ENa=ENa),
+                    dict(Ix=np.asarray(Ix), state=tuple(state)), dict(method='euler', dt=dt), SOURCES)
+    def compute():
+        V, n, m, h, _ = euler(Ix, dt, state)
+        return dict(V=V, n=n, m=m, h=h)
+    return cache.cached(key, compute, None if features is None else lambda r: features(r['V'], r['n'], r['m'], r['h']))
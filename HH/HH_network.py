@@ -0,0 +1,159 @@
+# %%
+# Populations of the Hodgkin and Huxley neuron (HH_model.py kinetics and
+# parameters) coupled by chemical synapses and gap junctions.
+#
+# All neurons' V, n, m, h are arrays advanced together by forward Euler, as in
+# HH_model.euler. Chemical synapses are stored as a CSR matrix (row = presynaptic
+# neuron) with per-synapse delay and excitatory/inhibitory type aligned with its
+# data. A spike looks up only its own row and schedules its synapses in the event
+# queue: one list per future step (modulo the longest delay) of the indices of
+# the synapses that arrive then. The per-step synaptic cost is proportional to
+# the synapses of the neurons that spiked, not to N^2, and the queue holds only
+# the pending events rather than a (max delay, 2, N) array of conductances. Each
+# neuron has one exponentially decaying excitatory and one inhibitory
+# conductance. Gap junctions are a symmetric sparse conductance matrix applied as
+# a sparse matrix-vector product (cost proportional to the number of junctions).
+#
+# units as in HH_model.py: ms, mV, mS/cm2 (weights are conductance jumps),
+# uA/cm2 (injected current)
+#
+# example: 10^4 neurons, 100 random targets each, 20% inhibitory
+#   net = HHNetwork(10000, syn=random_synapses(10000, 100, 0.02, 0.08, seed=1))
+#   times, ids = net.run(np.full(10000, 8.0), 2000)
+import numpy as np
+from collections import namedtuple
+from scipy import sparse
+
+from HH_model import (alphan, betan, alpham, betam, alphah, betah, ninfty, minfty, hinfty,
+                      Cm, gL, EL, gK, EK, gNa, ENa)
+
+# W: csr_matrix (pre x post) of weights; delay (ms) and inhibitory (bool) are
+# aligned with W.data
+Synapses = namedtuple('Synapses', ['W', 'delay', 'inhibitory'])
+
+
+def synapses(N, pre, post, weight, delay=1.0, inhibitory=False):
+    # Synapses from per-synapse lists (duplicates are kept as separate synapses)
+    pre, post = np.asarray(pre), np.asarray(post)
+    weight, delay, inhibitory = (np.broadcast_to(a, pre.shape) for a in (weight, delay, inhibitory))
+    order = np.argsort(pre, kind='stable')
+    indptr = np.r_[0, np.cumsum(np.bincount(pre, minlength=N))]
+    W = sparse.csr_matrix((np.asarray(weight, dtype=float)[order], post[order], indptr), shape=(N, N))
+    return Synapses(W, np.asarray(delay, dtype=float)[order], np.asarray(inhibitory, dtype=bool)[order])
+
+
+def random_synapses(N, k, w_exc, w_inh, frac_inh=0.2, delay=(1.0, 5.0), seed=0):
+    # every neuron projects to k random targets (no self-connections); the last
+    # frac_inh of the neurons are inhibitory; delays uniform in [delay[0], delay[1]] ms
+    rng = np.random.default_rng(seed)
+    pre = np.repeat(np.arange(N), k)
+    post = rng.integers(0, N-1, N*k)
+    post += post >= pre # skip self
+    inh = pre >= N - int(round(frac_inh*N))
+    return synapses(N, pre, post, np.where(inh, w_inh, w_exc), rng.uniform(*delay, N*k), inh)
+
+
+def gap_junctions(N, a, b, g):
+    # symmetric junctions of conductance g between neurons a[i] and b[i]
+    a, b = np.asarray(a), np.asarray(b)
+    g = np.broadcast_to(np.asarray(g, dtype=float), a.shape)
+    G = sparse.coo_matrix((np.r_[g, g], (np.r_[a, b], np.r_[b, a])), shape=(N, N)).tocsr()
+    return G
+
+
+# %%
+class HHNetwork:
+    def __init__(self, N, dt=.01, syn=None, gap=None, E_exc=0.0, E_inh=-80.0, tau_exc=2.0, tau_inh=5.0,
+                 thresh=0.0, V0=-65.0):
+        """
+        Parameters:
+            N        : number of neurons.
+            dt       : time step (ms).
+            syn      : Synapses, or None.
+            gap      : symmetric csr_matrix of gap junction conductances, or None.
+            E_exc, E_inh, tau_exc, tau_inh : synaptic reversal potentials (mV) and
+                       conductance decay time constants (ms).
+            thresh   : spike detection threshold (mV), upward crossings.
+            V0       : initial potential; the gates start at their steady state.
+        """
+        self.N, self.dt, self.thresh = N, dt, thresh
+        self.E = np.array([E_exc, E_inh])[:, None]
+        self.decay = np.exp(-dt/np.array([tau_exc, tau_inh]))[:, None]
+        self.V = np.full(N, float(V0))
+        self.n, self.m, self.h = ninfty(self.V), minfty(self.V), hinfty(self.V)
+        self.g = np.zeros((2, N)) # excitatory, inhibitory synaptic conductance
+        self.step_index = 0
+
+        self.syn = syn
+        if syn is not None:
+            self.indptr, self.post = syn.W.indptr, syn.W.indices
+            self.weight, self.kind = syn.W.data, syn.inhibitory.astype(int)
+            self.delay_steps = np.maximum(np.rint(syn.delay/dt).astype(int), 1)
+            self.queue = [[] for _ in range(self.delay_steps.max(initial=1)+1)] # arrays of synapse indices
+        self.gap = gap
+        if gap is not None:
+            self.gap_total = np.asarray(gap.sum(axis=1)).ravel()
+
+    def _deliver(self, spiking):
+        # schedule the synapses of the spiking neurons
+        start, stop = self.indptr[spiking], self.indptr[spiking+1]
+        lengths = stop-start
+        if lengths.sum() == 0:
+            return
+        ids = np.repeat(start-np.cumsum(lengths)+lengths, lengths) + np.arange(lengths.sum())
+        slot = (self.step_index + self.delay_steps[ids]) % len(self.queue)
+        order = np.argsort(slot, kind='stable')
+        ids, slot = ids[order], slot[order]
+        bounds = np.r_[0, np.flatnonzero(np.diff(slot))+1, len(ids)]
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            self.queue[slot[a]].append(ids[a:b])
+
+    def step(self, Ix=0.0):
+        """
+        Advance one dt with injected current Ix (scalar or per neuron); returns the
+        indices of the neurons that spiked.
+        """
+        V, n, m, h, dt = self.V, self.n, self.m, self.h, self.dt
+        if self.syn is not None:
+            slot = self.step_index % len(self.queue)
+            if self.queue[slot]:
+                due = np.concatenate(self.queue[slot])
+                np.add.at(self.g, (self.kind[due], self.post[due]), self.weight[due])
+                self.queue[slot] = []
+        I_syn = (self.g*(V-self.E)).sum(axis=0)
+        I_gap = self.gap @ V - self.gap_total*V if self.gap is not None else 0.0
+
+        self.n = n+dt*((1-n)*alphan(V)-n*betan(V))
+        self.m = m+dt*((1-m)*alpham(V)-m*betam(V))
+        self.h = h+dt*((1-h)*alphah(V)-h*betah(V))
+        self.V = V+dt*(-gL*(V-EL)-gK*n**4*(V-EK)-gNa*m**3*h*(V-ENa)-I_syn+I_gap+Ix)/Cm
+        self.g *= self.decay
+
+        spiking = np.flatnonzero((self.V >= self.thresh) & (V < self.thresh))
+        self.step_index += 1
+        if self.syn is not None and len(spiking):
+            self._deliver(spiking)
+        return spiking
+
+    def run(self, Ix, n_steps, record=None):
+        """
+        n_steps steps. Ix is a scalar, a per-neuron array (N,) or one row per step
+        (n_steps, N). record: indices of neurons whose V to keep.
+
+        Returns spike times (ms) and neuron ids, plus the recorded V
+        (n_steps, len(record)) if record is given.
+        """
+        Ix = np.asarray(Ix, dtype=float)
+        per_step = Ix.ndim == 2
+        times, ids = [], []
+        Vrec = None if record is None else np.empty((n_steps, len(record)))
+        for i in range(n_steps):
+            spiking = self.step(Ix[i] if per_step else Ix)
+            if len(spiking):
+                times.append(np.full(len(spiking), self.step_index*self.dt))
+                ids.append(spiking)
+            if record is not None:
+                Vrec[i] = self.V[record]
+        times = np.concatenate(times) if times else np.zeros(0)
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype=int)
+        return (times, ids) if record is None else (times, ids, Vrec)
@@ -0,0 +1,529 @@
+# %%
+# Two-variable reductions of the Hodgkin and Huxley model (HH_model.py kinetics
+# and parameters) for threshold analysis without million-step simulations.
+#
+# m is instantaneous (m = minfty(V)) and one slow gate is slaved to the other
+# along the line both follow during firing, anchored at the full model's rest
+# state (so the reduced and the 4-D rest points are the same):
+#   mode 'n': state (V, n), h = h_rest + SLAVE_SLOPE*(n - n_rest)
+#   mode 'h': state (V, h), n = n_rest + (h - h_rest)/SLAVE_SLOPE
+# Without the lag of m the reduced cell charges and fires too fast, so two
+# constants per mode are calibrated against the 4-D model (calibrate()): an
+# effective capacitance Cm in the V equation, fitted to the thresholds of pulses
+# and steps, and a fixed delay added to every spike time, the mean latency
+# difference that remains (the activation lag of m during the upstroke).
+#
+# PhasePlane precomputes, on a grid of (V, y) for one constant current, the vector
+# field, the V nullcline, the fixed points and a spike map: the latency of the
+# first spike (upward 0 mV crossing) from every grid node, all nodes traced
+# together by RK4. The threshold separatrix is the V above which each row of the
+# grid fires (refined by tracing inside the bracketing grid cell). latency_at()
+# then answers for any state by interpolating the map, and traces the trajectory
+# only for states next to the separatrix, where the latency changes too fast to
+# interpolate.
+#
+# StepAnalysis answers threshold and latency queries for current steps
+# (amplitude, duration) from rest by interpolating a table built once: the
+# latency of every (amplitude, duration) of the AMPS x DURATIONS grid and the
+# threshold of every duration, all traced together. Queries are then a few
+# microseconds; building the table takes some seconds. Tables and phase planes
+# can be kept in a simcache.SimCache. validate() compares the answers with the 4-D
+# model (HH_model.euler) and flags every fire / no-fire disagreement.
+#
+# example:
+#   steps = StepAnalysis(ReducedHH('n'))
+#   steps.threshold(duration=1.0)     # uA/cm2, 1 ms pulse
+#   steps.latency(10.0)               # ms, first spike of a long step
+#   plane = steps.plane(10.0)         # fields, nullclines and separatrix at 10 uA/cm2
+#   print(table(validate(steps, amps=[5, 10, 20], durations=[1.0, np.inf])))
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from collections import namedtuple
+from scipy.optimize import brentq, minimize_scalar
+
+import HH_model as H
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+SOURCES = H.SOURCES + [os.path.abspath(__file__)] # files defining the reduced model, for simcache keys
+
+# rest of the full model at Ix = 0
+V_REST = brentq(lambda V: H.Iion(H.ninfty(V), H.minfty(V), H.hinfty(V), V), -70, -60)
+N_REST, H_REST = H.ninfty(V_REST), H.hinfty(V_REST)
+SLAVE_SLOPE = -1.33 # dh/dn during repetitive firing at 10 uA/cm2, from fit_slaving()
+CALIBRATION = dict(n=(1.488, 0.467), h=(1.386, 0.542)) # (Cm, delay ms) per mode, from calibrate()
+
+# step grid of StepAnalysis: amplitudes (uA/cm2) and durations (ms, multiples of
+# the default dt; inf is a step that outlasts t_max)
+AMPS = np.r_[np.arange(0.0, 10.0, 0.25), np.arange(10.0, 50.5, 1.0)]
+DURATIONS = np.r_[np.unique(np.round(np.geomspace(0.1, 30.0, 25), 2)), np.inf]
+CAL_DURATIONS = (0.5, 1.0, 5.0, np.inf)
+CAL_AMPS = (3.0, 5.0, 10.0, 20.0, 40.0)
+
+# kind: 'stable', 'unstable' or 'saddle'; eig: eigenvalues of the Jacobian
+FixedPoint = namedtuple('FixedPoint', ['V', 'y', 'kind', 'eig'])
+
+
+def fit_slaving(amp=10.0, dt=.01, stop=300.0, settle=40.0):
+    # least squares slope of h against n (through the rest state) of the 4-D model
+    # firing under a step of amp from t = 20 ms
+    t = np.arange(0, stop, dt)
+    V, n, m, h, _ = H.euler(np.where(t > 20, amp, 0.0), dt, H.HHState(0, V_REST, N_REST, H.minfty(V_REST), H_REST))
+    k = t > settle
+    dn, dh = n[k]-N_REST, h[k]-H_REST
+    return np.sum(dn*dh)/np.sum(dn**2)
+
+
+def calibrate(mode='n', slope=SLAVE_SLOPE, durations=CAL_DURATIONS, amps=CAL_AMPS, t_max=30.0, dt=.01):
+    """
+    Fit (Cm, delay) of ReducedHH(mode) to the 4-D model: Cm minimizes the
+    squared relative errors of the thresholds of steps of durations and of the
+    latencies of steps of amps (after removing their mean difference), and the
+    delay is that mean difference (ms).
+    """
+    thr = np.array([full_threshold(d, t_max=t_max, dt=dt) for d in durations])
+    lat = np.array([full_latency(a, t_max=t_max, dt=dt) for a in amps])
+    V0, y0 = ReducedHH(mode).rest()
+    def run(Cm):
+        model = ReducedHH(mode, slope, Cm=Cm, delay=0.0)
+        t_red = trace_threshold(model, durations, t_max=t_max, dt=dt)[0]
+        l_red = model.trace(V0, y0, np.array(amps), t_max, dt)[0]
+        return t_red, l_red
+    def cost(Cm):
+        t_red, l_red = run(Cm)
+        d = lat-l_red
+        return np.sum((t_red/thr-1)**2)+np.sum(((d-d.mean())/lat)**2)
+    Cm = minimize_scalar(cost, bounds=(1.0, 2.5), method='bounded', options=dict(xatol=.005)).x
+    return Cm, np.mean(lat-run(Cm)[1])
+
+
+# %%
+class ReducedHH:
+    def __init__(self, mode='n', slope=SLAVE_SLOPE, Cm=None, delay=None):
+        """
+        Parameters:
+            mode  : 'n' for the (V, n) plane or 'h' for the (V, h) plane.
+            slope : dh/dn of the slaving line through the rest state.
+            Cm    : effective capacitance (uF/cm2), default CALIBRATION[mode].
+            delay : added to every spike time (ms), default CALIBRATION[mode].
+        """
+        if mode not in ('n', 'h'):
+            raise ValueError("mode must be 'n' or 'h'")
+        self.mode, self.slope = mode, slope
+        self.Cm = CALIBRATION[mode][0] if Cm is None else Cm
+        self.delay = CALIBRATION[mode][1] if delay is None else delay
+        self.alpha, self.beta = (H.alphan, H.betan) if mode == 'n' else (H.alphah, H.betah)
+        self.yinfty = H.ninfty if mode == 'n' else H.hinfty
+
+    def params(self):
+        return dict(mode=self.mode, slope=self.slope, Cm=self.Cm, delay=self.delay)
+
+    def gates(self, V, y):
+        # n, m, h of the reduced state
+        if self.mode == 'n':
+            n, h = y, np.clip(H_REST+self.slope*(y-N_REST), 0, 1)
+        else:
+            n, h = np.clip(N_REST+(y-H_REST)/self.slope, 0, 1), y
+        return n, H.minfty(V), h
+
+    def rhs(self, V, y, I):
+        # dV/dt, dy/dt (vectorized)
+        n, m, h = self.gates(V, y)
+        return (H.Iion(n, m, h, V)+I)/self.Cm, (1-y)*self.alpha(V)-y*self.beta(V)
+
+    def project(self, state):
+        # reduced (V, y) of an HHState or (V, n, m, h)
+        V, n, m, h = tuple(state)[-4:]
+        return V, (n if self.mode == 'n' else h)
+
+    def rest(self):
+        return V_REST, (N_REST if self.mode == 'n' else H_REST)
+
+    def trace(self, V, y, I, stop, dt=.01, level=0.0, until=np.inf, record=False):
+        """
+        RK4 from (V, y) (arrays or scalars, broadcast with I and until) for stop
+        ms, with current I up to time until (ms) and 0 after it.
+
+        Returns the latency of the first upward crossing of level plus the
+        model's delay (ms, nan if none; 0 for states already at or above level)
+        and the final V, y. Trajectories are dropped once they have spiked; with
+        record=True the (t, V, y) of all steps are returned as well (then nothing
+        is dropped).
+        """
+        V, y, I, until = (np.array(a, dtype=float) for a in np.broadcast_arrays(V, y, I, until))
+        shape = V.shape
+        V, y, I = V.ravel(), y.ravel(), I.ravel()
+        n_until = np.round(until.ravel()/dt) # steps with current on
+        latency = np.full(V.shape, np.nan)
+        active = np.flatnonzero(V < level) if not record else np.arange(len(V))
+        latency[V >= level] = 0.0
+        n_steps = int(round(stop/dt))
+        Vrec, yrec = ([V.copy()], [y.copy()]) if record else (None, None)
+        for i in range(n_steps):
+            if len(active) == 0:
+                break
+            v, g = V[active], y[active]
+            c = np.where(i < n_until[active], I[active], 0.0)
+            k1 = self.rhs(v, g, c)
+            k2 = self.rhs(v+dt/2*k1[0], g+dt/2*k1[1], c)
+            k3 = self.rhs(v+dt/2*k2[0], g+dt/2*k2[1], c)
+            k4 = self.rhs(v+dt*k3[0], g+dt*k3[1], c)
+            v1 = v+dt/6*(k1[0]+2*k2[0]+2*k3[0]+k4[0])
+            g1 = g+dt/6*(k1[1]+2*k2[1]+2*k3[1]+k4[1])
+            up = (v < level) & (v1 >= level) & np.isnan(latency[active])
+            latency[active[up]] = (i+(level-v[up])/(v1[up]-v[up]))*dt+self.delay
+            V[active], y[active] = v1, g1
+            if record:
+                Vrec.append(V.copy())
+                yrec.append(y.copy())
+            else:
+                active = active[~up]
+        out = latency.reshape(shape), V.reshape(shape), y.reshape(shape)
+        if record:
+            t = np.arange(len(Vrec))*dt
+            return out + (t, np.array(Vrec).reshape((-1,)+shape), np.array(yrec).reshape((-1,)+shape))
+        return out
+
+    def fixed_points(self, I, V_range=(-100.0, 60.0), n=2000):
+        # intersections of the V nullcline with y = yinfty(V)
+        Vg = np.linspace(*V_range, n)+1e-7 # off the removable singularities at -55 and -40 mV
+        f = lambda V: self.rhs(V, self.yinfty(V), I)[0]
+        fg = f(Vg)
+        points = []
+        for k in np.flatnonzero(np.sign(fg[:-1]) != np.sign(fg[1:])):
+            V = brentq(f, Vg[k], Vg[k+1])
+            y = self.yinfty(V)
+            eig = np.linalg.eigvals(self.jacobian(V, y, I))
+            if np.all(eig.real < 0):
+                kind = 'stable'
+            elif np.all(eig.real > 0):
+                kind = 'unstable'
+            else:
+                kind = 'saddle'
+            points.append(FixedPoint(V, y, kind, eig))
+        return points
+
+    def jacobian(self, V, y, I, eps=1e-6):
+        # central differences
+        dV = np.array(self.rhs(V+eps, y, I))-np.array(self.rhs(V-eps, y, I))
+        dy = np.array(self.rhs(V, y+eps, I))-np.array(self.rhs(V, y-eps, I))
+        return np.c_[dV, dy]/(2*eps)
+
+
+# %%
+class PhasePlane:
+    def __init__(self, model, I, V=(-90.0, 40.0), y=(0.0, 1.0), shape=(131, 101), t_max=30.0, dt=.01,
+                 cache=None):
+        """
+        Fields and spike map of model at constant current I (uA/cm2).
+
+        Parameters:
+            model  : ReducedHH.
+            V, y   : (min, max) of the grid axes.
+            shape  : number of grid nodes along V and y.
+            t_max  : how long each node is traced (ms); later spikes are missed.
+            dt     : RK4 step (ms).
+            cache  : simcache.SimCache for the grids, or None.
+
+        Attributes:
+            V, y         : grid axes; arrays below are (len(V), len(y)).
+            dV, dy       : vector field.
+            latency      : first spike latency from each node (ms, with the
+                           model's delay; nan if none).
+            V_nullcline  : y where dV = 0 on each V (first crossing, nan if none).
+            y_nullcline  : yinfty(V).
+            separatrix   : threshold V on each y row: all higher V fire (nan if
+                           the row has no silent node below 0 mV next to a firing one).
+            fixed_points : list of FixedPoint.
+        """
+        self.model, self.I, self.t_max, self.dt = model, float(I), t_max, dt
+        self.V = np.linspace(*V, shape[0])+1e-7 # off the removable singularities
+        self.y = np.linspace(*y, shape[1])
+        Vg, yg = np.meshgrid(self.V, self.y, indexing='ij')
+        self.dV, self.dy = model.rhs(Vg, yg, I)
+
+        def compute():
+            latency = model.trace(Vg, yg, I, t_max, dt)[0]
+            return dict(latency=latency, separatrix=self._separatrix(latency))
+        if cache is None:
+            maps = compute()
+        else:
+            key = cache.key('HH_reduced', dict(model.params(), I=self.I), None,
+                            dict(V=V, y=y, shape=shape, t_max=t_max, dt=dt), SOURCES)
+            maps = cache.cached(key, compute)
+        self.latency, self.separatrix = maps['latency'], maps['separatrix']
+
+        self.y_nullcline = model.yinfty(self.V)
+        self.V_nullcline = np.full(len(self.V), np.nan)
+        s = np.sign(self.dV)
+        for i in range(len(self.V)):
+            k = np.flatnonzero(s[i, :-1] != s[i, 1:])
+            if len(k):
+                k = k[0]
+                self.V_nullcline[i] = self.y[k]-self.dV[i, k]*(self.y[k+1]-self.y[k])/(self.dV[i, k+1]-self.dV[i, k])
+        self.fixed_points = model.fixed_points(I)
+
+    def _separatrix(self, latency, n=16, rounds=3):
+        # per y row: the highest silent node and the firing node above it bracket
+        # the separatrix (lower firing nodes are rebound spikes from hyperpolarized
+        # states); n points inside every bracket are traced together per round and
+        # the bracket zooms into the first that fires
+        silent = np.isnan(latency)
+        last = len(self.V)-1-np.argmax(silent[::-1], axis=0)
+        upper = np.minimum(last+1, len(self.V)-1)
+        rows = np.flatnonzero(silent.any(axis=0) & (last < upper) & (self.V[upper] < 0))
+        lo, hi = self.V[last[rows]], self.V[upper[rows]]
+        y = self.y[rows]
+        frac = np.arange(1, n+1)/(n+1)
+        for _ in range(rounds):
+            V = lo[:, None]+frac*(hi-lo)[:, None]
+            f = np.isfinite(self.model.trace(V, y[:, None], self.I, self.t_max, self.dt)[0])
+            k = np.where(f.any(axis=1), np.argmax(f, axis=1), n) # index of the first firing point, n: none
+            Vb = np.c_[lo, V, hi]
+            lo, hi = Vb[np.arange(len(k)), k], Vb[np.arange(len(k)), k+1]
+        out = np.full(len(self.y), np.nan)
+        out[rows] = hi
+        return out
+
+    def fires(self, V, y):
+        return np.isfinite(self.latency_at(V, y))
+
+    def latency_at(self, V, y, spread=0.5):
+        """
+        First spike latency (ms, nan if none within t_max) from states (V, y):
+        bilinear interpolation of the map where the four surrounding nodes agree
+        (all silent, or all firing within spread ms of each other), RK4 tracing
+        elsewhere and outside the grid.
+        """
+        V, y = (np.array(a, dtype=float) for a in np.broadcast_arrays(V, y))
+        shape = V.shape
+        V, y = V.ravel(), y.ravel()
+        i = np.clip(np.searchsorted(self.V, V)-1, 0, len(self.V)-2)
+        j = np.clip(np.searchsorted(self.y, y)-1, 0, len(self.y)-2)
+        u = (V-self.V[i])/(self.V[i+1]-self.V[i])
+        w = (y-self.y[j])/(self.y[j+1]-self.y[j])
+        corners = np.stack([self.latency[i, j], self.latency[i+1, j], self.latency[i, j+1], self.latency[i+1, j+1]])
+        weights = np.stack([(1-u)*(1-w), u*(1-w), (1-u)*w, u*w])
+        fire = np.isfinite(corners)
+        inside = (u >= 0) & (u <= 1) & (w >= 0) & (w <= 1)
+        silent = inside & ~fire.any(axis=0)
+        with np.errstate(invalid='ignore'):
+            smooth = inside & fire.all(axis=0) & (np.ptp(corners, axis=0) <= spread)
+        out = np.full(len(V), np.nan)
+        out[smooth] = (weights*corners).sum(axis=0)[smooth]
+        near = ~(silent | smooth)
+        if near.any():
+            out[near] = self.model.trace(V[near], y[near], self.I, self.t_max, self.dt)[0]
+        return out.reshape(shape)
+
+
+# %%
+def trace_threshold(model, durations, state=None, amp_range=(0.0, 50.0), t_max=30.0, dt=.01, n=32, rounds=3):
+    """
+    Lowest amplitude (uA/cm2) of a step of each duration (ms) from state
+    (default: rest) that fires within t_max (nan if none in amp_range), and the
+    latency at that amplitude. n amplitudes per duration are traced together per
+    round, each round zooming into the bracket of the previous one.
+    """
+    durations = np.atleast_1d(np.asarray(durations, dtype=float))
+    V, y = model.rest() if state is None else state
+    lo = np.full(len(durations), float(amp_range[0]))
+    hi = np.full(len(durations), float(amp_range[1]))
+    thr, lat_thr = np.full(len(durations), np.nan), np.full(len(durations), np.nan)
+    rows = np.arange(len(durations))
+    for _ in range(rounds):
+        amps = lo[:, None]+np.linspace(0, 1, n)*(hi-lo)[:, None]
+        lat = model.trace(V, y, amps, t_max, dt, until=durations[rows, None])[0]
+        fires = np.isfinite(lat)
+        k = np.argmax(fires, axis=1)
+        ok = fires.any(axis=1) # rows that fire at the top of the bracket
+        r = np.arange(len(rows))
+        thr[rows[ok]], lat_thr[rows[ok]] = amps[r, k][ok], lat[r, k][ok]
+        zoom = ok & (k > 0)
+        lo, hi = amps[r, k-1][zoom], amps[r, k][zoom]
+        rows = rows[zoom]
+        if len(rows) == 0:
+            break
+    return thr, lat_thr
+
+
+class StepAnalysis:
+    def __init__(self, model=None, amps=AMPS, durations=DURATIONS, t_max=30.0, dt=.01, cache=None, **plane_kw):
+        """
+        Threshold and latency of current steps from the rest state of model
+        (default ReducedHH('n')), interpolated from a table over amps (uA/cm2) x
+        durations (ms, increasing, ending with inf). t_max: how long after the
+        step onset a spike is looked for (ms). The table is built here (and
+        stored in cache if given); phase planes are built on first use.
+        """
+        self.model = ReducedHH() if model is None else model
+        self.amps, self.durations = np.asarray(amps, dtype=float), np.asarray(durations, dtype=float)
+        self.cache, self.t_max, self.dt, self.plane_kw = cache, t_max, dt, plane_kw
+        self.planes = {}
+
+        def compute():
+            V, y = self.model.rest()
+            lat = self.model.trace(V, y, self.amps[:, None], t_max, dt, until=self.durations[None, :])[0]
+            thr, lat_thr = trace_threshold(self.model, self.durations, amp_range=(self.amps[0], self.amps[-1]),
+                                           t_max=t_max, dt=dt)
+            return dict(latency=lat, threshold=thr, threshold_latency=lat_thr)
+        if cache is None:
+            table_ = compute()
+        else:
+            key = cache.key('HH_reduced_steps', self.model.params(), dict(amps=self.amps, durations=self.durations),
+                            dict(t_max=t_max, dt=dt), SOURCES)
+            table_ = cache.cached(key, compute)
+        self.latency_table = table_['latency'] # (len(amps), len(durations)), nan: no spike
+        self.thresholds, self.threshold_latency = table_['threshold'], table_['threshold_latency']
+        self._log_durations = np.log(self.durations[:-1])
+
+    def plane(self, I):
+        I = float(I)
+        if I not in self.planes:
+            self.planes[I] = PhasePlane(self.model, I, t_max=self.t_max, dt=self.dt, cache=self.cache,
+                                        **self.plane_kw)
+        return self.planes[I]
+
+    def _columns(self, duration):
+        # bracketing duration columns and the weight of the second (linear in log duration)
+        last = len(self.durations)-1
+        if duration >= min(self.durations[-2], self.t_max): # the step outlasts the search window
+            return last, last, 0.0
+        if duration < self.durations[0]:
+            raise ValueError('duration %g ms is below the table (%g ms)' % (duration, self.durations[0]))
+        j = min(np.searchsorted(self.durations[:-1], duration, 'right')-1, last-2)
+        w = (np.log(duration)-self._log_durations[j])/(self._log_durations[j+1]-self._log_durations[j])
+        return j, j+1, w
+
+    def _column_latency(self, j, amp):
+        # latency against amplitude in column j, from the threshold knot up
+        if not amp >= self.thresholds[j]:
+            return np.nan
+        lat = self.latency_table[:, j]
+        k = (self.amps > self.thresholds[j]) & np.isfinite(lat)
+        return np.interp(amp, np.r_[self.thresholds[j], self.amps[k]], np.r_[self.threshold_latency[j], lat[k]])
+
+    def threshold(self, duration=np.inf, state=None):
+        """
+        Lowest amplitude (uA/cm2) of a step of duration (ms) from state (default:
+        rest, looked up in the table; other states are traced) that fires within
+        t_max, nan if none within the table's amplitudes.
+        """
+        if state is not None:
+            return trace_threshold(self.model, [duration], state, (self.amps[0], self.amps[-1]), self.t_max,
+                                   self.dt)[0][0]
+        j0, j1, w = self._columns(duration)
+        return (1-w)*self.thresholds[j0]+w*self.thresholds[j1]
+
+    def latency(self, amp, duration=np.inf, state=None):
+        """
+        First spike latency (ms after onset, nan if none within t_max) of a step
+        of amp (uA/cm2) lasting duration (ms) from state (default: rest, looked up
+        in the table; other states are traced).
+        """
+        if state is not None:
+            return float(self.model.trace(state[0], state[1], amp, self.t_max, self.dt, until=duration)[0])
+        if not amp >= self.threshold(duration):
+            return np.nan
+        j0, j1, w = self._columns(duration)
+        l0, l1 = self._column_latency(j0, amp), self._column_latency(j1, amp)
+        if np.isnan(l0) or np.isnan(l1): # amp lies between the two columns' thresholds
+            return float(l1 if np.isnan(l0) else l0)
+        return float((1-w)*l0+w*l1)
+
+
+# %%
+# Validation against the 4-D model
+def full_latency(amp, duration=np.inf, t_max=30.0, dt=.01, level=0.0):
+    # first upward crossing of level after onset of the step in HH_model.euler, from rest
+    t = np.arange(0, t_max+dt/2, dt)
+    Ix = np.where(t < duration, amp, 0.0)
+    V = H.euler(Ix, dt, H.HHState(0, V_REST, N_REST, H.minfty(V_REST), H_REST))[0]
+    k = np.flatnonzero((V[:-1] < level) & (V[1:] >= level))
+    if len(k) == 0:
+        return np.nan
+    k = k[0]
+    return t[k]+(level-V[k])/(V[k+1]-V[k])*dt
+
+
+def full_threshold(duration=np.inf, amp_range=(0.0, 50.0), tol=.01, t_max=30.0, dt=.01):
+    # bisection on full_latency; nan if the top of amp_range does not fire
+    lo, hi = amp_range
+    if np.isnan(full_latency(hi, duration, t_max, dt)):
+        return np.nan
+    while hi-lo > tol:
+        mid = (lo+hi)/2
+        if np.isnan(full_latency(mid, duration, t_max, dt)):
+            lo = mid
+        else:
+            hi = mid
+    return hi
+
+
+def _timed(f, *args):
+    t0 = time.process_time()
+    out = f(*args)
+    return out, time.process_time()-t0
+
+
+def validate(steps, amps=(2.0, 5.0, 10.0, 20.0), durations=(0.5, 1.0, 5.0, np.inf), thresholds=True):
+    """
+    Compare StepAnalysis answers with the 4-D model at the same t_max and dt.
+    Returns one row (dict) per (amp, duration) with both latencies, and with
+    thresholds=True one row per duration with both thresholds (amp = nan), each
+    with the CPU time of both answers. A row where one model fires (or has a
+    threshold) and the other does not is flagged mismatch=True and has error
+    inf, like a spike count mismatch in HH_solvers.errors().
+    """
+    rows = []
+    for duration in durations:
+        if thresholds:
+            reduced, cpu_r = _timed(steps.threshold, duration)
+            full, cpu_f = _timed(lambda d: full_threshold(d, t_max=steps.t_max, dt=steps.dt), duration)
+            rows.append(dict(amp=np.nan, duration=duration, quantity='threshold', reduced=reduced, full=full,
+                             reduced_cpu=cpu_r, full_cpu=cpu_f))
+        for amp in amps:
+            reduced, cpu_r = _timed(steps.latency, amp, duration)
+            full, cpu_f = _timed(full_latency, amp, duration, steps.t_max, steps.dt)
+            rows.append(dict(amp=amp, duration=duration, quantity='latency', reduced=reduced, full=full,
+                             reduced_cpu=cpu_r, full_cpu=cpu_f))
+    for r in rows:
+        r['mismatch'] = bool(np.isnan(r['reduced']) != np.isnan(r['full']))
+        r['error'] = np.inf if r['mismatch'] else r['reduced']-r['full']
+    return rows
+
+
+def table(rows):
+    lines = ['%-9s %8s %8s %9s %9s %9s %11s %11s' % ('quantity', 'amp', 'duration', 'reduced', 'full', 'error',
+                                                    'reduced ms', 'full ms')]
+    for r in rows:
+        lines.append('%-9s %8.2f %8.2f %9.3f %9.3f %9.3f %11.3f %11.3f%s' % (
+            r['quantity'], r['amp'], r['duration'], r['reduced'], r['full'], r['error'], 1e3*r['reduced_cpu'],
+            1e3*r['full_cpu'], '  MISMATCH' if r['mismatch'] else ''))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='reduced HH threshold analysis, validated against the 4-D model')
+    parser.add_argument('--mode', default='n', choices=['n', 'h'], help='slow variable of the reduced plane')
+    parser.add_argument('--amps', type=float, nargs='+', default=[2.0, 5.0, 10.0, 20.0], help='uA/cm2')
+    parser.add_argument('--durations', type=float, nargs='+', default=[0.5, 1.0, 5.0, np.inf], help='ms')
+    parser.add_argument('--cache', default=None, help='simcache directory for the step table and phase planes')
+    args = parser.parse_args(argv)
+    cache = None
+    if args.cache:
+        from simcache import SimCache
+        cache = SimCache(args.cache)
+    steps = StepAnalysis(ReducedHH(args.mode), cache=cache)
+    rows = validate(steps, args.amps, args.durations)
+    print(table(rows))
+    n = sum(r['mismatch'] for r in rows)
+    if n:
+        print('\n%d fire / no-fire mismatches' % n)
+
+
+if __name__ == '__main__':
+    main()
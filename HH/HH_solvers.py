@@ -0,0 +1,233 @@
+# %%
+# Accuracy versus cost of the solvers used for the Hodgkin and Huxley physics in
+# this repo:
+#   'euler'   forward Euler of HH.py / HH_model.euler, over a grid of dt
+#   'odeint'  LSODA (as in the pump model), over a grid of rtol = atol
+#   'neuron'  NEURON's h.hh in one compartment (as in NEURON/action_potential.py):
+#             fixed step backward Euler and Crank-Nicolson over dt, and CVODE over atol
+#
+# Every run gets the same smooth current step (HH_model.smooth_step, as a
+# continuous function of time) and is compared with a reference solution of the
+# same model on spike times (upward 0 mV crossings), spike peaks and the
+# threshold of the first spike (V where dV/dt first reaches 10 mV/ms): LSODA at
+# rtol = atol = 1e-12 for 'euler' and 'odeint', NEURON's CVODE at atol =
+# NEURON_REF_ATOL for 'neuron' (within 1e-4 ms of Crank-Nicolson at dt = 1e-4).
+# The CPU time of each solve is measured with time.process_time. pareto() keeps
+# the runs no other run beats on both cost and error, and cheapest() picks the
+# cheapest run within an accuracy budget, e.g.
+#
+#   rows = frontier()
+#   print(table(pareto(rows, 'spike_err')))
+#   cheapest(rows, spike_err=0.05, peak_err=1.0, thresh_err=0.5)
+#
+# NEURON's hh mechanism is matched to HH_model: celsius 6.3 (tadj = 1), el_hh =
+# EL, and a 100 um2 section so that 1 nA of IClamp current is 1000 uA/cm2. The
+# current is played into the IClamp on a PLAY_DT grid. NEURON's betam uses
+# exp(-(V+65)/18) where HH_model has .0556, so NEURON is scored against its own
+# reference: against the LSODA one the model difference (a few hundredths of a
+# ms, growing with each spike) would mix with, and partly cancel, the
+# discretization error. If NEURON is not installed its rows are left out.
+#
+# usage:
+#   python HH_solvers.py [--stop 100] [--amp 10] [--metric spike_err]
+import os
+import sys
+import time
+import importlib.util
+import argparse
+import numpy as np
+from scipy.integrate import odeint
+
+import HH_model as H
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import channels
+
+EULER_DT = [0.05, 0.025, 0.01, 0.005, 0.0025, 0.001]
+ODEINT_RTOL = [1e-3, 1e-4, 1e-5, 1e-6, 1e-7, 1e-8, 1e-10]
+NEURON_DT = [0.05, 0.025, 0.01, 0.005, 0.001]
+CVODE_ATOL = [1e-2, 1e-3, 1e-4, 1e-5, 1e-6]
+OUT_DT = 0.001 # output grid of the variable step solvers (ms)
+PLAY_DT = 0.01 # grid of the current played into NEURON (ms); CVODE stops at every point
+NEURON_REF_ATOL = 1e-9 # CVODE atol of the reference of the 'neuron' rows
+
+HH_KINETICS = channels.build(channels.HH_CHANNELS, Cm=H.Cm)
+V0 = -65.0
+
+
+def step_current(amp=10.0, start=20.0, duration=60.0, width=1.0):
+    # the smoothed step of HH.py as a function of time (uA/cm2)
+    return lambda t: H.smooth_step(t, amp, start, duration, width)
+
+
+# %%
+# Solvers: each returns (t, V) for the protocol I(t) up to stop (ms)
+def run_euler(I, stop, dt):
+    t = np.arange(0, stop+dt/2, dt)
+    V = H.euler(I(t), dt, H.rest_state(V0))[0]
+    return t, V
+
+
+def run_odeint(I, stop, rtol, hmax=0.0):
+    t = np.arange(0, stop+OUT_DT/2, OUT_DT)
+    y = odeint(HH_KINETICS.rhs, HH_KINETICS.steady_state(V0), t, args=(I,), Dfun=HH_KINETICS.jacobian,
+               rtol=rtol, atol=rtol, hmax=hmax)
+    return t, y[:, 0]
+
+
+def run_neuron(I, stop, dt=None, atol=None, secondorder=0):
+    # dt: fixed step; atol: CVODE
+    from neuron import h
+    h.load_file('stdrun.hoc')
+    sec = h.Section(name='hh_solvers')
+    sec.L = sec.diam = np.sqrt(100/np.pi) # 100 um2
+    sec.insert('hh')
+    sec(0.5).hh.el = H.EL
+    h.celsius = 6.3
+    ic = h.IClamp(sec(0.5))
+    ic.dur = 1e9
+    tp = np.arange(0, stop+PLAY_DT/2, PLAY_DT)
+    t_play, I_play = h.Vector(tp), h.Vector(I(tp)*1e-3) # uA/cm2 -> nA on 100 um2
+    I_play.play(ic._ref_amp, t_play, 1) # continuous (interpolated) play
+    cvode = h.CVode()
+    cvode.active(atol is not None)
+    h.secondorder = secondorder
+    if atol is not None:
+        cvode.atol(atol)
+    else:
+        h.dt = dt
+    # CVODE: every step is recorded and interpolated onto the OUT_DT grid afterwards
+    t_rec, v = h.Vector().record(h._ref_t), h.Vector().record(sec(0.5)._ref_v)
+    h.finitialize(V0)
+    h.continuerun(stop)
+    cvode.active(0)
+    h.secondorder = 0
+    if atol is None:
+        return np.array(t_rec), np.array(v)
+    t = np.arange(0, stop+OUT_DT/2, OUT_DT)
+    return t, np.interp(t, np.array(t_rec), np.array(v))
+
+
+def reference(I, stop, solver='odeint'):
+    # the reference solution the rows of solver are scored against
+    if solver == 'neuron':
+        return run_neuron(I, stop, atol=NEURON_REF_ATOL)
+    return run_odeint(I, stop, 1e-12, hmax=0.05)
+
+
+# %%
+# Measurements
+def spike_times(t, V, level=0.0):
+    # upward crossings of level, linearly interpolated
+    k = np.flatnonzero((V[:-1] < level) & (V[1:] >= level))
+    return t[k] + (level-V[k])/(V[k+1]-V[k])*(t[k+1]-t[k])
+
+
+def spike_peaks(t, V, level=0.0):
+    # maximum V between each upward and the next downward crossing of level
+    up = np.flatnonzero((V[:-1] < level) & (V[1:] >= level))+1
+    down = np.flatnonzero((V[:-1] >= level) & (V[1:] < level))+1
+    peaks = []
+    for u in up:
+        d = down[down > u]
+        peaks.append(V[u:d[0] if len(d) else len(V)].max())
+    return np.array(peaks)
+
+
+def threshold(t, V, slope=10.0):
+    # V where dV/dt first reaches slope (mV/ms) before the first spike
+    dV = np.diff(V)/np.diff(t)
+    k = np.flatnonzero((dV[:-1] < slope) & (dV[1:] >= slope))
+    if len(k) == 0:
+        return np.nan
+    k = k[0]
+    frac = (slope-dV[k])/(dV[k+1]-dV[k])
+    return V[k+1] + frac*(V[k+2]-V[k+1])
+
+
+def measure(t, V):
+    return dict(spikes=spike_times(t, V), peaks=spike_peaks(t, V), thresh=threshold(t, V))
+
+
+def errors(m, ref):
+    # max |error| of spike times (ms) and peaks (mV), threshold error (mV); inf if
+    # the spike count differs from the reference
+    if len(m['spikes']) != len(ref['spikes']):
+        return dict(spike_err=np.inf, peak_err=np.inf, thresh_err=abs(m['thresh']-ref['thresh']))
+    if len(m['spikes']) == 0:
+        return dict(spike_err=0.0, peak_err=0.0, thresh_err=abs(m['thresh']-ref['thresh']))
+    return dict(spike_err=np.abs(m['spikes']-ref['spikes']).max(), peak_err=np.abs(m['peaks']-ref['peaks']).max(),
+                thresh_err=abs(m['thresh']-ref['thresh']))
+
+
+# %%
+def runs(stop):
+    # (solver, setting, function) for every point of the grid
+    out = [('euler', 'dt=%g' % dt, lambda I, dt=dt: run_euler(I, stop, dt)) for dt in EULER_DT]
+    out += [('odeint', 'rtol=%g' % r, lambda I, r=r: run_odeint(I, stop, r)) for r in ODEINT_RTOL]
+    if importlib.util.find_spec('neuron') is None:
+        return out
+    out += [('neuron', 'bE dt=%g' % dt, lambda I, dt=dt: run_neuron(I, stop, dt=dt)) for dt in NEURON_DT]
+    out += [('neuron', 'CN dt=%g' % dt, lambda I, dt=dt: run_neuron(I, stop, dt=dt, secondorder=2)) for dt in NEURON_DT]
+    out += [('neuron', 'cvode atol=%g' % a, lambda I, a=a: run_neuron(I, stop, atol=a)) for a in CVODE_ATOL]
+    return out
+
+
+def frontier(I=None, stop=100.0):
+    """
+    Run every solver setting on the protocol I(t) (default: step_current()) and
+    return one row (dict) per setting with its CPU time, spike count and errors
+    against the reference of its solver (see reference()).
+    """
+    I = step_current() if I is None else I
+    refs = {}
+    rows = []
+    for solver, setting, run in runs(stop):
+        if solver not in refs:
+            refs[solver] = measure(*reference(I, stop, solver))
+        t0 = time.process_time()
+        t, V = run(I)
+        cpu = time.process_time()-t0
+        m = measure(t, V)
+        rows.append(dict(solver=solver, setting=setting, cpu=cpu, n_spikes=len(m['spikes']), **errors(m, refs[solver])))
+    return rows
+
+
+def pareto(rows, metric='spike_err'):
+    # rows not dominated in (cpu, metric), by increasing cpu
+    front, best = [], np.inf
+    for r in sorted(rows, key=lambda r: (r['cpu'], r[metric])):
+        if r[metric] < best:
+            front.append(r)
+            best = r[metric]
+    return front
+
+
+def cheapest(rows, **budget):
+    # the fastest row with every given error within budget (e.g. spike_err=0.05), or None
+    ok = [r for r in rows if all(r[k] <= v for k, v in budget.items())]
+    return min(ok, key=lambda r: r['cpu']) if ok else None
+
+
+def table(rows):
+    lines = ['%-7s %-18s %9s %4s %10s %10s %10s' % ('solver', 'setting', 'cpu (s)', 'n', 'spike ms', 'peak mV', 'thresh mV')]
+    for r in rows:
+        lines.append('%-7s %-18s %9.4f %4d %10.2e %10.2e %10.2e' % (r['solver'], r['setting'], r['cpu'], r['n_spikes'],
+                                                                 r['spike_err'], r['peak_err'], r['thresh_err']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HH solver accuracy vs CPU time')
+    parser.add_argument('--stop', type=float, default=100.0, help='simulated time (ms)')
+    parser.add_argument('--amp', type=float, default=10.0, help='step amplitude (uA/cm2)')
+    parser.add_argument('--metric', default='spike_err', choices=['spike_err', 'peak_err', 'thresh_err'])
+    args = parser.parse_args(argv)
+    rows = frontier(step_current(args.amp), args.stop)
+    print(table(rows))
+    print('\nPareto front (cpu vs %s):' % args.metric)
+    print(table(pareto(rows, args.metric)))
+
+
+if __name__ == '__main__':
+    main()
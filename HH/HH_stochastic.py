@@ -0,0 +1,324 @@
+# %%
+# Stochastic-channel mode of the Hodgkin and Huxley model (HH_model.py kinetics
+# and parameters), for threshold variability with a finite number of channels,
+# e.g. at the axon initial segment.
+#
+# Two descriptions of channel noise, both forward Euler at dt:
+#   'langevin': the gates get diffusion noise scaled by the channel count
+#               (Fox & Lu 1994): dx = (a(1-x) - bx) dt + sqrt((a(1-x) + bx)/N) dW
+#   'markov':   channel-count Markov chains (Na: 8 states m0h0..m3h1, K: 5 states
+#               n0..n4). Every dt each state's channels leave with probability
+#               1 - exp(-R dt) and split over the destinations in proportion to
+#               the rates (a multinomial per state, drawn as binomials per
+#               transition conditional on the earlier ones). Converges to the
+#               exact Markov process as dt -> 0.
+#
+# All trials run as one batch: V, gates and counts are arrays over trials, but
+# each trial has its own random streams (SeedSequence(seed, spawn_key=(trial,))
+# and its children), drawn in chunks per trial, so trial k gives the same result
+# whatever batch it is run in and any trial can be re-run alone (check_trials).
+# The Markov transitions are binomials computed from per-trial uniforms
+# (binomial(): inversion for small means, Hoermann's BTRS rejection otherwise),
+# which keeps the draws vectorised over trials and states.
+#
+# example: threshold and latency distributions from a current ramp (Exp A in
+# Hypothesis.md)
+#   time = np.arange(0, 50, .01)
+#   Ix = ramp(time, slope=1.0, start=5.0)
+#   res = simulate(Ix, .01, n_trials=2000, area=100.0, method='langevin', seed=1)
+#   threshold, latency = threshold_latency(res, Ix, .01, onset=5.0)
+import numpy as np
+from collections import namedtuple
+from scipy.special import gammaln
+
+from HH_model import (alphan, betan, alpham, betam, alphah, betah, ninfty, minfty, hinfty,
+                      Cm, gL, EL, gK, EK, gNa, ENa)
+
+# channel densities, channels/um2 (squid axon estimates, Hille 2001)
+NA_DENSITY = 60.0
+K_DENSITY = 18.0
+
+# first spike (ms, nan if none) and spike count per trial, V (n_steps+1, n_trials)
+# if recorded, and the final state (dict of arrays over trials)
+StochasticResult = namedtuple('StochasticResult', ['first_spike', 'n_spikes', 'V', 'state'])
+
+
+def channel_counts(area, Na_density=NA_DENSITY, K_density=K_DENSITY):
+    # number of Na and K channels in a patch of `area` um2
+    return int(round(area*Na_density)), int(round(area*K_density))
+
+
+def trial_rngs(seed, trials, stream=()):
+    # one independent generator per trial index; stream selects a child stream
+    # of each trial (e.g. (1,) for the Markov transition uniforms)
+    return [np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=(int(k),)+stream)))
+            for k in trials]
+
+
+def ramp(time, slope, start=0.0):
+    # current ramp starting at `start` (ms), slope in uA/cm2 per ms
+    return slope*np.maximum(time-start, 0)
+
+
+# %%
+# Markov channel-count scheme: transitions (source, destination, rate, multiplicity)
+# over the 13 states [Na m0h0 m1h0 m2h0 m3h0 m0h1 m1h1 m2h1 m3h1, K n0 n1 n2 n3 n4]
+def _transitions():
+    tr = []
+    for j in (0, 4): # h0, h1 rows
+        for i in range(3):
+            tr.append((j+i, j+i+1, 'am', 3-i))
+            tr.append((j+i+1, j+i, 'bm', i+1))
+    for i in range(4):
+        tr.append((i, i+4, 'ah', 1))
+        tr.append((i+4, i, 'bh', 1))
+    for i in range(4):
+        tr.append((8+i, 8+i+1, 'an', 4-i))
+        tr.append((8+i+1, 8+i, 'bn', i+1))
+    return tr
+
+_TR = _transitions()
+_N_STATES = 13
+_NA_OPEN, _K_OPEN = 7, 12
+_RATES = ['am', 'bm', 'ah', 'bh', 'an', 'bn']
+_TR_KIND = np.array([_RATES.index(k) for _, _, k, _ in _TR])
+_TR_MULT = np.array([m for _, _, _, m in _TR], dtype=float)
+_TR_SRC = np.array([s for s, _, _, _ in _TR])
+_TR_DST = np.array([d for _, d, _, _ in _TR])
+# column of each transition among its source state's destinations (at most 3)
+_TR_SLOT = np.array([[s for s, _, _, _ in _TR[:k]].count(_TR[k][0]) for k in range(len(_TR))])
+_INFLOW = np.zeros((len(_TR), _N_STATES), dtype=int)
+_INFLOW[np.arange(len(_TR)), _TR_DST] = 1
+_MARKOV_CHUNK = 50 # steps of transition uniforms drawn per trial at a time
+_ATTEMPTS = 4 # BTRS attempts covered by the drawn uniforms, the rest go to the fallback stream
+_UNIFORM_STREAM, _FALLBACK_STREAM = (1,), (2,) # per-trial child streams of the Markov mode
+
+
+def _rates(V):
+    return np.array([alpham(V), betam(V), alphah(V), betah(V), alphan(V), betan(V)])
+
+
+def binomial(n, p, u, fallback, owner):
+    """
+    Binomial(n, p) draws (integer arrays n and probabilities p of the same
+    shape) from pre-drawn uniforms u, shape n.shape + (2*_ATTEMPTS,). Means
+    n*min(p, 1-p) below 10 are drawn by inversion from u[..., 0], larger ones
+    by Hoermann's BTRS transformed rejection (1993) from pairs of u; elements
+    rejected _ATTEMPTS times are drawn from fallback[owner], the generator of
+    the element's trial. Exact, and each element depends only on its own u.
+    """
+    shape = np.shape(n)
+    n = np.ravel(n).astype(np.int64)
+    p = np.ravel(p).astype(float)
+    u = np.reshape(u, (len(n), -1))
+    flip = p > 0.5
+    q = np.where(flip, 1-p, p) # draw Binomial(n, q), q <= 1/2, and flip back
+    k = np.zeros(len(n), dtype=np.int64)
+    live = (n > 0) & (q > 0)
+    small = live & (n*q < 10)
+    k[small] = _inversion(n[small], q[small], u[small, 0])
+    i = np.flatnonzero(live & ~small)
+    if len(i):
+        k[i], rejected = _btrs(n[i], q[i], u[i])
+        for j in i[rejected]:
+            k[j] = fallback[np.ravel(owner)[j]].binomial(n[j], q[j])
+    return np.where(flip, n-k, k).reshape(shape)
+
+
+def _inversion(n, q, u):
+    # walk the cdf up from 0 with the pmf recurrence, all elements still below
+    # their uniform advancing together
+    k = np.zeros(len(n), dtype=np.int64)
+    i = np.arange(len(n))
+    pmf = np.exp(n*np.log1p(-q))
+    cdf = pmf.copy()
+    ratio = q/(1-q)
+    j = 0
+    go = u > cdf
+    while go.any():
+        i, n, u, pmf, cdf, ratio = i[go], n[go], u[go], pmf[go], cdf[go], ratio[go]
+        j += 1
+        pmf *= (n-j+1)/j*ratio
+        cdf += pmf
+        k[i] = j
+        go = (u > cdf) & (j < n) & (pmf > 0)
+    return k
+
+
+def _btrs(n, q, u):
+    # BTRS for n*q >= 10, q <= 1/2, one (U, V) pair of u per attempt; returns
+    # the draws and the mask of elements rejected in every attempt
+    spq = np.sqrt(n*q*(1-q))
+    b = 1.15 + 2.53*spq
+    a = -0.0873 + 0.0248*b + 0.01*q
+    c = n*q + 0.5
+    vr = 0.92 - 4.2/b
+    alpha = (2.83 + 5.1/b)*spq
+    lpq = np.log(q/(1-q))
+    m = np.floor((n+1)*q)
+    h = gammaln(m+1) + gammaln(n-m+1)
+    k = np.zeros(len(n), dtype=np.int64)
+    pending = np.arange(len(n))
+    for t in range(_ATTEMPTS):
+        j = pending
+        U = u[j, 2*t] - 0.5
+        V = u[j, 2*t+1]
+        us = 0.5 - np.abs(U)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kk = np.floor((2*a[j]/us + b[j])*U + c[j])
+            ok = (kk >= 0) & (kk <= n[j])
+            ks = np.where(ok, kk, 0)
+            accept = ok & (((us >= 0.07) & (V <= vr[j]))
+                           | (np.log(V*alpha[j]/(a[j]/us**2 + b[j]))
+                              <= h[j] - gammaln(ks+1) - gammaln(n[j]-ks+1) + (ks-m[j])*lpq[j]))
+        k[j[accept]] = kk[accept]
+        pending = j[~accept]
+        if not len(pending):
+            break
+    rejected = np.zeros(len(n), dtype=bool)
+    rejected[pending] = True
+    return k, rejected
+
+
+def _markov_step(counts, V, dt, u, fallback):
+    # counts (n_trials, 13) after one step. Each transition takes a binomial of
+    # the channels its source has left, with its probability conditional on the
+    # source's earlier transitions (slot by slot), so together they are the
+    # multinomial over [stay, destinations]. u (n_trials, n_tr, 2*_ATTEMPTS)
+    # are the trials' uniforms for this step.
+    T = len(V)
+    r = _TR_MULT[:, None]*_rates(V)[_TR_KIND] # (n_tr, n_trials)
+    R = np.zeros((_N_STATES, T))
+    np.add.at(R, _TR_SRC, r)
+    P = (-np.expm1(-R*dt)[_TR_SRC]*r/R[_TR_SRC]).T # (n_trials, n_tr) per-channel probabilities
+    left = counts.copy()
+    done = np.zeros((T, _N_STATES)) # probability taken by the earlier slots
+    flow = np.zeros((T, len(_TR)), dtype=counts.dtype)
+    owner = np.broadcast_to(np.arange(T)[:, None], (T, len(_TR)))
+    for j in range(3):
+        tr = np.flatnonzero(_TR_SLOT == j)
+        src = _TR_SRC[tr]
+        p = np.clip(P[:, tr]/np.maximum(1-done[:, src], 1e-300), 0, 1)
+        flow[:, tr] = binomial(left[:, src], p, u[:, tr], fallback, owner[:, tr])
+        left[:, src] -= flow[:, tr]
+        done[:, src] += P[:, tr]
+    return left + flow @ _INFLOW
+
+
+def markov_rest_counts(rngs, N_Na, N_K, V0=-65.0):
+    # channel counts drawn from the steady-state distribution at V0, (n_trials, 13)
+    m, h, n = minfty(V0), hinfty(V0), ninfty(V0)
+    pm = np.array([1, 3, 3, 1])*m**np.arange(4)*(1-m)**(3-np.arange(4))
+    p_na = np.concatenate([pm*(1-h), pm*h])
+    p_k = np.array([1, 4, 6, 4, 1])*n**np.arange(5)*(1-n)**(4-np.arange(5))
+    return np.array([np.concatenate([g.multinomial(N_Na, p_na), g.multinomial(N_K, p_k)]) for g in rngs])
+
+
+# %%
+def simulate(Ix, dt, n_trials=None, area=100.0, method='langevin', seed=0, trials=None,
+             V0=-65.0, thresh=0.0, record=False, chunk=1000):
+    """
+    Run a batch of stochastic trials of the current Ix (uA/cm2, one value per
+    step): shape (n_steps,) for the same current in every trial or
+    (n_steps, n_trials). area is the membrane area in um2 (sets the channel
+    counts), trials the trial indices that select the random streams (default
+    0..n_trials-1). Trials start at rest at V0; spikes are upward crossings of
+    thresh (mV).
+
+    Returns a StochasticResult.
+    """
+    Ix = np.asarray(Ix, dtype=float)
+    if trials is None:
+        trials = np.arange(Ix.shape[1] if Ix.ndim == 2 else n_trials)
+    trials = np.asarray(trials)
+    T = len(trials)
+    n_steps = Ix.shape[0]
+    N_Na, N_K = channel_counts(area)
+    rngs = trial_rngs(seed, trials)
+
+    V = np.full(T, float(V0))
+    if method == 'langevin':
+        m, h, n = np.full(T, minfty(V0)), np.full(T, hinfty(V0)), np.full(T, ninfty(V0))
+        N = np.array([N_Na, N_Na, N_K], dtype=float)[:, None]
+    elif method == 'markov':
+        counts = markov_rest_counts(rngs, N_Na, N_K, V0)
+        uniform_rngs = trial_rngs(seed, trials, _UNIFORM_STREAM)
+        fallback_rngs = trial_rngs(seed, trials, _FALLBACK_STREAM)
+        chunk = min(chunk, _MARKOV_CHUNK) # (steps, trials, n_tr, 2*_ATTEMPTS) uniforms per chunk
+    else:
+        raise ValueError("method must be 'langevin' or 'markov'")
+
+    first_spike = np.full(T, np.nan)
+    n_spikes = np.zeros(T, dtype=int)
+    Vrec = np.empty((n_steps+1, T)) if record else None
+    if record:
+        Vrec[0] = V
+    sqdt = np.sqrt(dt)
+    for c0 in range(0, n_steps, chunk):
+        c1 = min(c0+chunk, n_steps)
+        if method == 'langevin':
+            # (steps, 3 gates, trials), drawn per trial so streams do not depend on the batch
+            xi = np.stack([g.standard_normal((c1-c0, 3)) for g in rngs], axis=-1)
+        else:
+            u = np.stack([g.random((c1-c0, len(_TR), 2*_ATTEMPTS)) for g in uniform_rngs], axis=1)
+        for i in range(c0, c1):
+            if method == 'langevin':
+                INa = gNa*m**3*h*(V-ENa)
+                IK = gK*n**4*(V-EK)
+                am, bm, ah, bh, an, bn = _rates(V)
+                x = np.array([m, h, n])
+                up = np.array([am, ah, an])*(1-x)
+                down = np.array([bm, bh, bn])*x
+                x = x + dt*(up-down) + sqdt*np.sqrt((up+down)/N)*xi[i-c0]
+                m, h, n = np.clip(x, 0, 1)
+            else:
+                INa = gNa*counts[:, _NA_OPEN]/N_Na*(V-ENa)
+                IK = gK*counts[:, _K_OPEN]/N_K*(V-EK)
+                counts = _markov_step(counts, V, dt, u[i-c0], fallback_rngs)
+            V_new = V + dt*(Ix[i] - INa - IK - gL*(V-EL))/Cm
+            crossed = (V_new >= thresh) & (V < thresh)
+            first_spike[crossed & np.isnan(first_spike)] = (i+1)*dt
+            n_spikes += crossed
+            V = V_new
+            if record:
+                Vrec[i+1] = V
+
+    if method == 'langevin':
+        state = dict(V=V, m=m, h=h, n=n)
+    else:
+        state = dict(V=V, counts=counts)
+    return StochasticResult(first_spike, n_spikes, Vrec, state)
+
+
+def threshold_latency(result, Ix, dt, onset=0.0):
+    """
+    Per trial, the injected current at the first spike (the threshold for a ramp)
+    and the latency of the first spike after onset (ms). nan for trials that did
+    not spike.
+    """
+    Ix = np.asarray(Ix, dtype=float)
+    spiked = ~np.isnan(result.first_spike)
+    i = np.where(spiked, np.rint(np.nan_to_num(result.first_spike)/dt).astype(int)-1, 0)
+    I = Ix[i] if Ix.ndim == 1 else Ix[i, np.arange(len(i))]
+    return np.where(spiked, I, np.nan), result.first_spike-onset
+
+
+def check_trials(Ix, dt, n_trials=8, area=20.0, seed=0, methods=('langevin', 'markov')):
+    """
+    Check that each trial of a batch is reproduced exactly when re-run alone
+    (simulate(..., trials=[k]) against row k of the full batch), per method.
+    Returns {method: True/False}.
+    """
+    ok = {}
+    for method in methods:
+        full = simulate(Ix, dt, n_trials=n_trials, area=area, method=method, seed=seed, record=True)
+        ok[method] = all(
+            np.array_equal(simulate(Ix, dt, area=area, method=method, seed=seed, trials=[k], record=True).V[:, 0],
+                           full.V[:, k])
+            for k in range(n_trials))
+    return ok
+
+
+if __name__ == '__main__':
+    time = np.arange(0, 30, .01)
+    print(check_trials(ramp(time, slope=1.0, start=5.0), .01))
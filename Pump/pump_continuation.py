@@ -0,0 +1,495 @@
+"""
+
+One-parameter numerical continuation of the pump model (pump_model.py): follows
+equilibria and periodic orbits (tonic firing) as one parameter changes and
+reports where their stability changes, instead of locating the transitions of
+HH_pump_Megwa.PY by brute-force 25 s simulations at every sweep point.
+
+The continuation parameter is any PumpParams field ('naih', 'nais', 'Imaxpump',
+...) or 'I_inj', the constant injected current (pA).
+
+Both branch types use pseudo-arclength predictor-corrector steps: an Euler
+predictor along the branch tangent, then Newton on the system plus the
+arclength condition, with the step size halved when Newton fails and increased
+when it converges quickly. Variables are scaled (SCALE, and the parameter by
+the width of its range) so the arclength is not dominated by V or blind to Nai.
+
+equilibria: F(y, lam) = dALLdt = 0, with the analytical Jacobian
+    (pump_model.jacobian). Test functions, checked between consecutive points
+    and located by bisection on the arclength:
+        'LP'  saddle-node (fold): the parameter component of the tangent
+              changes sign
+        'H'   Hopf: a complex pair of eigenvalues crosses the imaginary axis
+              (sign of the bialternate product prod(l_i + l_j), neutral saddles
+              are discarded)
+periodic orbits: single shooting. The unknowns are a point y0 on the orbit,
+    the period T and the parameter; the residual is phi_T(y0) - y0 plus a phase
+    condition, and the monodromy matrix and parameter sensitivity are integrated
+    with the orbit (variational equations, 9 + 81 + 9 states). Floquet
+    multipliers give the stability. Test functions:
+        'LPC' fold of cycles (parameter component of the tangent)
+        'PD'  period doubling (a multiplier crosses -1)
+    An orbit branch ends when the orbit shrinks onto an equilibrium (a Hopf
+    point). Branches start from a simulated firing state
+    (orbit_from_simulation) or from a Hopf point (continue_orbits_from_hopf).
+
+With NaiSwitch = 0, Nai is not a state variable; it is held at its starting
+value so that the Jacobians stay regular.
+
+In the language of the sweeps: onset of firing is a Hopf point (or a fold, for
+an onset through a saddle-node on the orbit) on the equilibrium branch or a fold
+of cycles, depolarization block is a Hopf point on the depolarized part of the
+equilibrium branch. The loss of the post-stimulus AHP is a property of the
+transient after the step, not of the steady states, and still needs simulation.
+
+example:
+    model = PumpModel()
+    y_eq = equilibrium(model, I_inj=0.0)
+    eq = continue_equilibria(model, 'I_inj', (0, 200), y_eq, lam0=0.0)
+    for sp in eq.special:
+        print(sp.kind, sp.lam, sp.info)
+    y0, T = orbit_from_simulation(model, I_inj=50.0)
+    firing = continue_orbits(model, 'I_inj', (0, 200), y0, T, lam0=50.0)
+    hopf = [sp for sp in eq.special if sp.kind == 'H'][-1]
+    small = continue_orbits_from_hopf(model, hopf, 'I_inj', (0, 200))
+
+units as in pump_model.py: ms, mV, pA, nS, M, pF
+
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy.integrate import odeint
+
+from pump_model import (PumpModel, dALLdt, jacobian, param0, simulate, _ODEINT_LOCK,
+                        minf_NaT, hinf_NaT, minf_NaP, ninf_Ks, minf_Kf, hinf1_Kf, hinf2_Kf)
+
+SCALE = np.array([10.0, 1, 1, 1, 1, 1, 1, 1, 0.01])
+""" typical size of each state variable: V (mV), the 7 gates, Nai (M) """
+
+Branch = namedtuple('Branch', ['param', 'kind', 'lam', 'y', 'T', 'stable', 'eig', 'vmin', 'vmax', 'special'])
+"""
+A computed branch: kind 'equilibrium' or 'orbit'; per point the parameter value
+lam, state y (the equilibrium, or the orbit's point y0), period T (nan for
+equilibria), stability, eigenvalues (equilibria) or Floquet multipliers (orbits)
+and the V range (vmin = vmax = V for equilibria); special is a list of
+SpecialPoint.
+"""
+
+SpecialPoint = namedtuple('SpecialPoint', ['kind', 'lam', 'y', 'T', 'index', 'info'])
+""" 'LP', 'H', 'LPC' or 'PD' between branch points index and index+1 """
+
+# =============================================================================
+# Helpers
+# =============================================================================
+def _setting(model, param, lam, I_inj):
+    # (parameters, injected current) with the continuation parameter set to lam
+    if param == 'I_inj':
+        return model.params, lam
+    return model.params.replace(**{param: lam}), I_inj
+
+def _solve(A, b):
+    # linear solve with row equilibration (the Nai rows are ~1e-9 of the V rows)
+    r = 1 / np.maximum(np.abs(A).max(axis=1), 1e-300)
+    return np.linalg.solve(A * r[:, None], b * r.reshape((-1,) + (1,) * (b.ndim - 1)))
+
+def rest_state(V, nai):
+    """ state with every gate at its steady state for V """
+    return np.array([V, minf_NaT(V), hinf_NaT(V), minf_NaP(V), ninf_Ks(V), minf_Kf(V), hinf1_Kf(V),
+                     hinf2_Kf(V), nai])
+
+NAI_RATE = 1e-3
+""" 1/ms; with NaiSwitch = 0 Nai is held by relaxing it to its start value at this rate """
+
+def _rhs(y, p, I, nai=None):
+    # dALLdt, with Nai pinned to nai when it is not a dynamic variable (NaiSwitch = 0)
+    f = dALLdt(y, 0.0, p, I)
+    if nai is not None:
+        f[8] = NAI_RATE * (nai - y[8])
+    return f
+
+def _jac(y, p, I, nai=None):
+    J = jacobian(y, 0.0, p, I)
+    if nai is not None:
+        J[8] = 0.0
+        J[8, 8] = -NAI_RATE
+    return J
+
+def _pinned_nai(model, y0):
+    return None if model.params['NaiSwitch'] else float(y0[8])
+
+def _hopf_sign(eig):
+    # sign of the bialternate product prod_{i<j} (l_i + l_j); changes at Hopf points
+    # and neutral saddles (l_i = -l_j real)
+    i, j = np.triu_indices(len(eig), 1)
+    s = eig[i] + eig[j]
+    return np.sign(np.prod(s / np.abs(s)).real)
+
+# =============================================================================
+# Problems: residual and Jacobian in scaled variables x
+# =============================================================================
+class _Problem:
+    def __init__(self, model, param, lam_scale, I_inj, nai=None):
+        self.model, self.param, self.lam_scale, self.I_inj, self.nai = model, param, lam_scale, I_inj, nai
+
+    def f(self, y, lam):
+        p, I = _setting(self.model, self.param, lam, self.I_inj)
+        return _rhs(y, p, I, self.nai)
+
+    def J(self, y, lam):
+        p, I = _setting(self.model, self.param, lam, self.I_inj)
+        return _jac(y, p, I, self.nai)
+
+    def valid(self, x):
+        return True
+
+    def finished(self, info):
+        return False
+
+    def f_lam(self, y, lam):
+        h = 1e-6 * max(abs(lam), self.lam_scale)
+        return (self.f(y, lam + h) - self.f(y, lam - h)) / (2 * h)
+
+class _Equilibria(_Problem):
+    kind = 'equilibrium'
+    tests = ('LP', 'H')
+
+    def pack(self, y, lam):
+        return np.r_[y / SCALE, lam / self.lam_scale]
+
+    def unpack(self, x):
+        return x[:9] * SCALE, x[-1] * self.lam_scale, np.nan
+
+    def residual(self, x):
+        y, lam, _ = self.unpack(x)
+        return self.f(y, lam) / SCALE
+
+    def jac(self, x):
+        y, lam, _ = self.unpack(x)
+        J = self.J(y, lam) * SCALE[None, :] / SCALE[:, None]
+        return np.c_[J, self.f_lam(y, lam) * self.lam_scale / SCALE]
+
+    def info(self, x, tangent):
+        y, lam, _ = self.unpack(x)
+        eig = np.linalg.eigvals(self.J(y, lam))
+        tests = dict(LP=np.sign(tangent[-1]), H=_hopf_sign(eig))
+        return dict(stable=bool(np.all(eig.real < 0)), eig=eig, vmin=y[0], vmax=y[0], tests=tests)
+
+    def describe(self, kind, x, info):
+        # confirm a located point and add details; None discards it
+        if kind != 'H':
+            return {}
+        eig = info['eig']
+        complex_ = eig[np.abs(eig.imag) > 1e-9]
+        if len(complex_) == 0:
+            return None
+        crit = complex_[np.argmin(np.abs(complex_.real))]
+        if abs(crit.real) > 1e-3 * abs(crit.imag): # neutral saddle
+            return None
+        return dict(omega=abs(crit.imag), period=2 * np.pi / abs(crit.imag))
+
+class _Orbits(_Problem):
+    kind = 'orbit'
+    tests = ('LPC', 'PD')
+
+    def __init__(self, model, param, lam_scale, I_inj, T_scale, nai=None, rtol=1e-9, min_amplitude=0.1):
+        _Problem.__init__(self, model, param, lam_scale, I_inj, nai)
+        self.T_scale, self.rtol, self.min_amplitude = T_scale, rtol, min_amplitude
+        self.y_ref = self.g_ref = None
+        self._last = (None, None)
+
+    def valid(self, x):
+        # an orbit shrinking to a point has period -> 0 or a vanishing flow direction
+        return x[9] > 0.05
+
+    def finished(self, info):
+        # the orbit has shrunk onto the equilibrium at a Hopf point
+        return info['vmax'] - info['vmin'] < self.min_amplitude
+
+    def set_reference(self, x):
+        # phase condition: stay on the hyperplane through y(x) orthogonal to the flow
+        y, lam, _ = self.unpack(x)
+        self.y_ref = y / SCALE
+        g = self.f(y, lam) / SCALE
+        self.g_ref = g / np.linalg.norm(g)
+
+    def pack(self, y, T, lam):
+        return np.r_[y / SCALE, T / self.T_scale, lam / self.lam_scale]
+
+    def unpack(self, x):
+        return x[:9] * SCALE, x[-1] * self.lam_scale, x[9] * self.T_scale
+
+    def flow(self, x, n_out=2):
+        """
+        phi_T(y0), monodromy M, d phi_T / d lam and V at n_out points along the
+        orbit (cached for the last x)
+        """
+        if self._last[0] is not None and np.array_equal(self._last[0], x) and n_out == 2:
+            return self._last[1]
+        y0, lam, T = self.unpack(x)
+
+        def rhs(z, t):
+            y = z[:9]
+            J = self.J(y, lam)
+            return np.r_[self.f(y, lam), (J @ z[9:90].reshape(9, 9)).ravel(), J @ z[90:] + self.f_lam(y, lam)]
+
+        def drhs(z, t):
+            # block diagonal approximation (drops the second derivatives of f), for
+            # LSODA's Newton iterations only
+            J = self.J(z[:9], lam)
+            D = np.zeros((99, 99))
+            D[:9, :9] = D[90:, 90:] = J
+            D[9:90, 9:90] = np.kron(J, np.eye(9))
+            return D
+
+        z0 = np.r_[y0, np.eye(9).ravel(), np.zeros(9)]
+        with _ODEINT_LOCK:
+            z = odeint(rhs, z0, np.linspace(0, T, n_out), Dfun=drhs, rtol=self.rtol, atol=1e-12, mxstep=100000)
+        out = z[-1, :9], z[-1, 9:90].reshape(9, 9), z[-1, 90:], z[:, 0]
+        if n_out == 2:
+            self._last = (x.copy(), out)
+        return out
+
+    def residual(self, x):
+        y0, lam, T = self.unpack(x)
+        yT = self.flow(x)[0]
+        return np.r_[(yT - y0) / SCALE, self.g_ref @ (x[:9] - self.y_ref)]
+
+    def jac(self, x):
+        y0, lam, T = self.unpack(x)
+        yT, M, s, _ = self.flow(x)
+        A = np.zeros((10, 11))
+        A[:9, :9] = (M - np.eye(9)) * SCALE[None, :] / SCALE[:, None]
+        A[:9, 9] = self.f(yT, lam) * self.T_scale / SCALE
+        A[:9, 10] = s * self.lam_scale / SCALE
+        A[9, :9] = self.g_ref
+        return A
+
+    def info(self, x, tangent):
+        y0, lam, T = self.unpack(x)
+        M = self.flow(x)[1]
+        mult, vec = np.linalg.eig(M * SCALE[None, :] / SCALE[:, None])
+        # the trivial multiplier (1) has the flow direction as its eigenvector; the
+        # slow Nai multiplier is close to 1 as well, so pick it by direction
+        g = self.f(y0, lam) / SCALE
+        trivial = np.argmax(np.abs(g.conj() @ vec) / np.linalg.norm(vec, axis=0))
+        others = np.delete(mult, trivial)
+        V = self.flow(x, n_out=200)[3]
+        tests = dict(LPC=np.sign(tangent[-1]), PD=np.sign(np.prod(others + 1).real))
+        return dict(stable=bool(np.all(np.abs(others) < 1)), eig=mult, vmin=V.min(), vmax=V.max(), tests=tests)
+
+    def describe(self, kind, x, info):
+        return dict(period=self.unpack(x)[2], multipliers=info['eig'])
+
+# =============================================================================
+# Continuation
+# =============================================================================
+def _tangent(A, previous):
+    # unit null vector of A (n x n+1), oriented along previous
+    t = _solve(np.vstack([A, previous]), np.r_[np.zeros(len(A)), 1.0])
+    t /= np.linalg.norm(t)
+    return t if t @ previous >= 0 else -t
+
+def _correct(problem, x_pred, x_prev, t_prev, s, tol=1e-9, max_iter=8):
+    # Newton on [G(x) = 0, t_prev . (x - x_prev) = s]; returns (x, A, iterations) or None
+    x = x_pred.copy()
+    for k in range(1, max_iter + 1):
+        A = problem.jac(x)
+        r = np.r_[problem.residual(x), t_prev @ (x - x_prev) - s]
+        dx = _solve(np.vstack([A, t_prev]), -r)
+        x = x + dx
+        if not np.all(np.isfinite(x)) or not problem.valid(x):
+            return None
+        if np.linalg.norm(dx) < tol * max(1.0, np.linalg.norm(x)):
+            return x, problem.jac(x), k
+    return None
+
+def _locate(problem, kind, x0, t0, value0, ds, iterations):
+    # bisection on the arclength s in (0, ds) for the sign change of test `kind`
+    lo, hi, found = 0.0, ds, None
+    for _ in range(iterations):
+        s = (lo + hi) / 2
+        c = _correct(problem, x0 + s * t0, x0, t0, s)
+        if c is None:
+            break
+        x, A, _ = c
+        info = problem.info(x, _tangent(A, t0))
+        found = (x, info)
+        if info['tests'][kind] == value0:
+            lo = s
+        else:
+            hi = s
+    return found
+
+def _direction(n, direction):
+    # tangent guess along the parameter axis
+    previous = np.zeros(n)
+    previous[-1] = direction
+    return previous
+
+def _continue(problem, x0, previous, lam_range, ds, ds_min, ds_max, max_steps, locate_iterations):
+    lo, hi = lam_range
+    if hasattr(problem, 'set_reference'):
+        problem.set_reference(x0)
+    t = _tangent(problem.jac(x0), previous)
+    x = x0
+    info = problem.info(x, t)
+    xs, infos, special = [x], [info], []
+    while len(xs) <= max_steps:
+        c = _correct(problem, x + ds * t, x, t, ds)
+        if c is None:
+            if ds / 2 < ds_min:
+                break
+            ds /= 2
+            continue
+        x_new, A, iterations = c
+        t_new = _tangent(A, t)
+        info_new = problem.info(x_new, t_new)
+        for kind in problem.tests:
+            if info_new['tests'][kind] != info['tests'][kind]:
+                found = _locate(problem, kind, x, t, info['tests'][kind], ds, locate_iterations)
+                if found is None:
+                    continue
+                xl, il = found
+                details = problem.describe(kind, xl, il)
+                if details is not None:
+                    y, lam, T = problem.unpack(xl)
+                    special.append(SpecialPoint(kind, lam, y, T, len(xs) - 1, details))
+        x, t, info = x_new, t_new, info_new
+        xs.append(x)
+        infos.append(info)
+        if hasattr(problem, 'set_reference'):
+            problem.set_reference(x)
+        lam = problem.unpack(x)[1]
+        if not lo <= lam <= hi or problem.finished(info):
+            break
+        if iterations <= 3:
+            ds = min(ds * 1.5, ds_max)
+
+    unpacked = [problem.unpack(x) for x in xs]
+    return Branch(problem.param, problem.kind, np.array([u[1] for u in unpacked]), np.array([u[0] for u in unpacked]),
+                  np.array([u[2] for u in unpacked]), np.array([i['stable'] for i in infos]),
+                  np.array([i['eig'] for i in infos]), np.array([i['vmin'] for i in infos]),
+                  np.array([i['vmax'] for i in infos]), special)
+
+# =============================================================================
+# Starting points
+# =============================================================================
+def equilibrium(model, I_inj=0.0, y0=None, V0=None, tol=1e-12, max_iter=50):
+    """
+    Equilibrium of model at constant I_inj by damped Newton, from y0 (default:
+    param0, or gates at steady state for V0 with param0's Nai).
+    """
+    if y0 is None:
+        y0 = param0 if V0 is None else rest_state(V0, param0[8])
+    y = np.array(y0, dtype=float)
+    nai = _pinned_nai(model, y)
+    norm = lambda y: np.linalg.norm(_rhs(y, model.params, I_inj, nai) / SCALE)
+    for _ in range(max_iter):
+        F = _rhs(y, model.params, I_inj, nai)
+        dy = _solve(_jac(y, model.params, I_inj, nai), -F)
+        step, r = 1.0, norm(y)
+        while step > 1e-4 and not norm(y + step * dy) < r:
+            step /= 2
+        y = y + step * dy
+        if np.linalg.norm(step * dy / SCALE) < tol:
+            return y
+    raise RuntimeError('no equilibrium found from %s' % (y0,))
+
+def orbit_from_simulation(model, I_inj, t_settle=20000.0, spike_height=-25.0, min_amplitude=10.0):
+    """
+    (y0, T) of the tonic firing orbit at constant I_inj from a simulation:
+    integrate t_settle ms, then take the state at the last upward crossing of
+    spike_height and the last interspike interval. Raises RuntimeError if the
+    model is not firing (fewer than 3 crossings, or V staying within
+    min_amplitude mV below spike_height over the last interval).
+    """
+    t, y, _ = simulate([(t_settle, I_inj)], model.params, dt=model.dt, rtol=1e-8, jac=True)
+    V = y[:, 0]
+    up = np.flatnonzero((V[:-1] < spike_height) & (V[1:] >= spike_height)) + 1
+    if len(up) < 3 or V[up[-2]:up[-1]].min() > spike_height - min_amplitude:
+        raise RuntimeError('no tonic firing at I_inj = %g' % I_inj)
+    return y[up[-1]], t[up[-1]] - t[up[-2]]
+
+def periodic_orbit(model, y0, T, I_inj=0.0, tol=1e-9, max_iter=30, max_step=0.2):
+    """
+    Refine a periodic orbit guess (y0, T) at constant I_inj by shooting Newton,
+    with Newton steps limited to max_step in scaled variables (Nai far from its
+    balance on the orbit moves the period a lot). Returns (y0, T).
+    """
+    problem = _Orbits(model, 'I_inj', max(abs(I_inj), 1.0), I_inj, T, _pinned_nai(model, y0))
+    x = problem.pack(np.asarray(y0, dtype=float), T, I_inj)
+    problem.set_reference(x)
+    for _ in range(max_iter):
+        dx = _solve(problem.jac(x)[:, :10], -problem.residual(x))
+        dx *= min(1.0, max_step / np.linalg.norm(dx))
+        x = x.copy()
+        x[:10] += dx
+        if x[9] < 0.05: # collapsing onto an equilibrium
+            break
+        if np.linalg.norm(dx) < tol * max(1.0, np.linalg.norm(x)):
+            y, _, T = problem.unpack(x)
+            return y, T
+    raise RuntimeError('shooting did not converge to an orbit')
+
+def continue_equilibria(model, param, lam_range, y0, lam0=None, I_inj=0.0, direction=1, ds=0.02, ds_min=1e-6,
+                        ds_max=0.05, max_steps=2000):
+    """
+    Follow the equilibrium through y0 (at param = lam0, default the model's
+    value) from lam0 in `direction` until param leaves lam_range or max_steps.
+    Step sizes are in scaled arclength, with the parameter scaled by the width
+    of lam_range. I_inj is the injected current when param is a model
+    parameter. Returns a Branch.
+    """
+    lam0 = (I_inj if param == 'I_inj' else model.params[param]) if lam0 is None else lam0
+    problem = _Equilibria(model, param, float(lam_range[1] - lam_range[0]), I_inj, _pinned_nai(model, y0))
+    x0 = problem.pack(np.asarray(y0, dtype=float), lam0)
+    return _continue(problem, x0, _direction(len(x0), direction), lam_range, ds, ds_min, ds_max, max_steps,
+                     locate_iterations=30)
+
+def continue_orbits(model, param, lam_range, y0, T, lam0=None, I_inj=0.0, direction=1, ds=0.005, ds_min=1e-5,
+                    ds_max=0.01, max_steps=300):
+    """
+    Follow the periodic orbit through (y0, T) (a guess is refined first with
+    periodic_orbit) like continue_equilibria. Returns a Branch.
+    """
+    lam0 = (I_inj if param == 'I_inj' else model.params[param]) if lam0 is None else lam0
+    model0 = model if param == 'I_inj' else PumpModel(model.params.replace(**{param: lam0}))
+    y0, T = periodic_orbit(model0, y0, T, lam0 if param == 'I_inj' else I_inj)
+    problem = _Orbits(model, param, float(lam_range[1] - lam_range[0]), I_inj, T, _pinned_nai(model, y0))
+    x0 = problem.pack(y0, T, lam0)
+    return _continue(problem, x0, _direction(len(x0), direction), lam_range, ds, ds_min, ds_max, max_steps,
+                     locate_iterations=12)
+
+def continue_orbits_from_hopf(model, point, param, lam_range, I_inj=0.0, ds=0.005, ds_min=1e-5, ds_max=0.01,
+                              max_steps=300):
+    """
+    Follow the orbits born at a Hopf SpecialPoint of an equilibrium branch in
+    param. The first step leaves the equilibrium along the real part of the
+    critical eigenvector at the Hopf period and fixed parameter; the corrector
+    then finds the small orbit. The side of the Hopf point the orbits lie on is
+    not chosen, it follows from the branch (it tells super- from subcritical).
+    Returns a Branch starting at that first orbit.
+    """
+    if point.kind != 'H':
+        raise ValueError('not a Hopf point: %s' % point.kind)
+    p, I = _setting(model, param, point.lam, I_inj)
+    nai = _pinned_nai(model, point.y)
+    eig, vec = np.linalg.eig(_jac(point.y, p, I, nai))
+    v = vec[:, np.argmin(np.abs(eig.real) + (np.abs(eig.imag) < 1e-9))]
+    problem = _Orbits(model, param, float(lam_range[1] - lam_range[0]), I_inj, point.info['period'], nai)
+    x0 = problem.pack(point.y, point.info['period'], point.lam)
+    # phase condition: the flow at y + eps Re(v) points along Im(v)
+    problem.y_ref = x0[:9]
+    problem.g_ref = v.imag / SCALE / np.linalg.norm(v.imag / SCALE)
+    t0 = np.r_[v.real / SCALE, 0.0, 0.0]
+    t0 /= np.linalg.norm(t0)
+    while True:
+        c = _correct(problem, x0 + ds * t0, x0, t0, ds)
+        if c is not None:
+            break
+        ds /= 2
+        if ds < ds_min:
+            raise RuntimeError('no orbit found next to the Hopf point at %s = %g' % (param, point.lam))
+    x1 = c[0]
+    return _continue(problem, x1, x1 - x0, lam_range, ds, ds_min, ds_max, max_steps, locate_iterations=12)
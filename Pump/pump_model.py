@@ -0,0 +1,501 @@
+"""
+
+Importable version of the fly motor neuron + Na/K pump model in HH_pump_Megwa.PY
+(Megwa, Pascual, Gunay, Pulver, Prinz 2023), for drivers that need to run it
+without the sweep loop and plots.
+
+Protocols are lists of (duration, injected current) segments and are integrated
+segment by segment, restarting odeint at every boundary (where the injected
+current is discontinuous anyway). A segment current is a constant or a callable
+of t: step_protocol builds the step, add_test_pulses splits it at test pulses
+and add_injectors adds continuous injectors such as Ramp and Zap. The state at a segment boundary -- the 9-element
+state vector, time and protocol position -- is a PumpCheckpoint; simulate() can
+start from one, so a long shared prefix (the 5 s hold, or a conditioning train)
+is simulated once and every branch continues from it. Because the uninterrupted
+run restarts at the same boundaries, branch results are bit-identical to it.
+
+PumpModel bundles a parameter record (PumpParams, slotted so thousands of
+instances stay small) with the RHS, analytical Jacobian, simulation and feature
+extraction. Instances share no mutable state and pickle cheaply, so different
+configurations can be simulated side by side in worker processes
+(simulate_many). Threads do not help: odeint is not re-entrant, so calls within
+one process are serialized by a lock. The module-level functions accept either
+a PumpParams or a plain dict.
+
+units as in HH_pump_Megwa.PY: ms, mV, pA, nS, M, pF
+
+"""
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+from scipy.integrate import odeint
+from scipy.signal import find_peaks
+from scipy import signal
+
+SOURCES = [os.path.abspath(__file__)]
+""" files defining the model, for simcache keys """
+
+# =============================================================================
+# Default Parameters (see HH_pump_Megwa.PY for descriptions)
+# =============================================================================
+DEFAULTS = dict(
+    g_Ks = 50.0, g_Kf = 15.1, g_NaP = 0.80, g_NaT = 100.0, g_leak_Na = 1.2, g_leak_K = 3.75,
+    C_m = 4.0, E_K = -80.0, F = 96485.3329e15, volume = 5.4994e-13, nao = 0.135,
+    Imaxpump = 75.0, naih = 40 * 10**(-3), nais = 10.0 * 10**(-3),
+    pumpswitch = 1, NaiSwitch = 1, dynrevswitch = 1, # [1,1,1] "DynDyn"
+)
+
+class PumpParams:
+    """
+    Compact parameter record with the fields of DEFAULTS. Supports p['name'] as
+    well as p.name, so it can be used wherever a parameter dict is expected.
+    """
+    __slots__ = tuple(DEFAULTS)
+
+    def __init__(self, **kwargs):
+        for name, value in DEFAULTS.items():
+            setattr(self, name, kwargs.pop(name, value))
+        if kwargs:
+            raise TypeError('unknown pump parameters: %s' % ', '.join(kwargs))
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return isinstance(other, PumpParams) and self.__getstate__() == other.__getstate__()
+
+    def __repr__(self):
+        return 'PumpParams(%s)' % ', '.join('%s=%r' % kv for kv in self.items())
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.__slots__]
+
+    def replace(self, **kwargs):
+        """ copy with some parameters changed """
+        return PumpParams(**dict(self.items(), **kwargs))
+
+# V, mNaT, hNaT, mNaP, n, mKf, hKf1, hKf2, Nai at rest of the DynDyn model
+param0 = np.array([-59.9312, 0.0, 1.0, 0.0, 0.0, 0.00, 1.0, 1.0, 0.0400811])
+
+# =============================================================================
+# Currents and Gates
+# =============================================================================
+def E_NaSwitch(nai, p):
+    if p['dynrevswitch'] == 0:
+        return 31.2 + 0 * np.log(p['nao']/nai)
+    return 25.694 * np.log(p['nao']/nai)
+
+def I_leak_NA(V, nai, p):
+    return p['g_leak_Na'] * (V - E_NaSwitch(nai, p))
+
+def I_leak_K(V, p):
+    return p['g_leak_K'] * (V - p['E_K'])
+
+def minf_NaT(V):
+    return  1 / (1 + np.exp((V + 29.13) / (-8.922)))
+def mtau_NaT(V):
+    return 3.861 - 3.434 / (1.0 + np.exp((V + 51.35) / (-5.98)))
+def hinf_NaT(V):
+    return 1 / (1 + np.exp((V + 40.0) / 6.048))
+def htau_NaT(V):
+    return 2.834 - 2.371 / (1.0 + np.exp((V + 21.9) / (-2.641)))
+def I_NaT(V, mNaT, hNaT, nai, p):
+    return p['g_NaT'] * mNaT**3 * hNaT * (V - E_NaSwitch(nai, p))
+
+def minf_NaP(V):
+    return 1 / (1 + np.exp((V + 48.77)/(-3.68)))
+def mtau_NaP(V):
+    return 1
+def I_NaP(V, mNaP, nai, p):
+    return p['g_NaP'] * mNaP * (V - E_NaSwitch(nai, p))
+
+def ninf_Ks(V):
+    return 1 / (1 + np.exp((V + 12.85)/(-19.91)))
+def ntau_Ks(V):
+    return 2.03 + 1.96 /(1 + np.exp((V - 29.83)/3.32))
+def I_Ks(V, n, p):
+    return p['g_Ks'] * n**4 * (V - p['E_K'])
+
+def minf_Kf(V):
+    return 1 / (1 + np.exp((V + 17.55)/(-7.27)))
+def mtau_Kf(V):
+    return 1.94 + 2.66 / (1 + np.exp((V - 8.12)/7.96))
+def hinf1_Kf(V):
+    return 1 / (1 + np.exp((V + 45.0)/6.0))
+def htau_Kf(V):
+    return 1.79 + 515.8 / (1 + np.exp((V + 147.4)/(28.66)))
+def hinf2_Kf(V):
+    return 1 / (1 + np.exp((V + 44.2) / 1.5))
+def I_Kf(V, mKf, hKf1, hKf2, p):
+    return p['g_Kf'] * mKf**4 * (0.95*hKf1 + 0.05*hKf2) * (V - p['E_K'])
+
+def I_pump(nai, p):
+    return p['Imaxpump'] / (1 + (np.exp((p['naih'] - nai) / p['nais'])))
+
+def dALLdt(param_vec, t, p, I_inj):
+    """
+    Right hand side of the 9 state variables (order as in param0), with the
+    injected current I_inj (pA) of the current protocol segment: a constant or
+    a callable of t (see the injectors below).
+    """
+    V, mNaT, hNaT, mNaP, n, mKf, hKf1, hKf2, nai = param_vec
+    if callable(I_inj):
+        I_inj = I_inj(t)
+
+    dVdt        = (-1/p['C_m']) * (I_Kf(V, mKf, hKf1, hKf2, p) + I_Ks(V, n, p)
+                + I_NaP(V, mNaP, nai, p) + I_NaT(V, mNaT, hNaT, nai, p)
+                + (I_leak_NA(V, nai, p) + I_leak_K(V, p)) + p['pumpswitch']*I_pump(nai, p)
+                - I_inj)
+
+    dmNaTdt     = (minf_NaT(V) - mNaT) /  mtau_NaT(V)
+    dhNaTdt     = (hinf_NaT(V) - hNaT) /  htau_NaT(V)
+    dmNaPdt     = (minf_NaP(V) - mNaP) /  mtau_NaP(V)
+    dndt        = (ninf_Ks(V)  - n)    /  ntau_Ks(V)
+    dmKfdt      = (minf_Kf(V)  - mKf)  /  mtau_Kf(V)
+    dhKf1dt     = (hinf1_Kf(V) - hKf1) /  htau_Kf(V)
+    dhKf2dt     = (hinf2_Kf(V) - hKf2) /  116
+
+    dNaidt  = p['NaiSwitch'] * (-1/(p['F']*p['volume'])) * ( I_NaT(V, mNaT, hNaT, nai, p)
+            + I_NaP(V, mNaP, nai, p)
+            + I_leak_NA(V, nai, p)
+            + 3*p['pumpswitch']*I_pump(nai, p))
+
+    return np.array([dVdt, dmNaTdt, dhNaTdt, dmNaPdt, dndt, dmKfdt, dhKf1dt, dhKf2dt, dNaidt])
+
+def _sig(V, a, b):
+    """ 1 / (1 + exp((V + a) / b)) and its derivative in V """
+    s = 1 / (1 + np.exp((V + a) / b))
+    return s, -s * (1 - s) / b
+
+def jacobian(param_vec, t, p, I_inj=0.0):
+    """
+    Analytical Jacobian of dALLdt (9 x 9, rows = derivatives, columns = states).
+    Usable as odeint's Dfun.
+    """
+    V, mNaT, hNaT, mNaP, n, mKf, hKf1, hKf2, nai = param_vec
+    J = np.zeros((9, 9))
+    E_Na = E_NaSwitch(nai, p)
+    dE_Na = 0.0 if p['dynrevswitch'] == 0 else -25.694 / nai
+    e = np.exp((p['naih'] - nai) / p['nais'])
+    dI_pump = p['pumpswitch'] * p['Imaxpump'] * e / (p['nais'] * (1 + e)**2)
+    hKf = 0.95*hKf1 + 0.05*hKf2
+    g_Na = p['g_NaT'] * mNaT**3 * hNaT + p['g_NaP'] * mNaP + p['g_leak_Na'] # total Na conductance
+    c = -1 / p['C_m']
+    J[0, 0] = c * (p['g_Kf'] * mKf**4 * hKf + p['g_Ks'] * n**4 + g_Na + p['g_leak_K'])
+    J[0, 1] = c * p['g_NaT'] * 3 * mNaT**2 * hNaT * (V - E_Na)
+    J[0, 2] = c * p['g_NaT'] * mNaT**3 * (V - E_Na)
+    J[0, 3] = c * p['g_NaP'] * (V - E_Na)
+    J[0, 4] = c * p['g_Ks'] * 4 * n**3 * (V - p['E_K'])
+    J[0, 5] = c * p['g_Kf'] * 4 * mKf**3 * hKf * (V - p['E_K'])
+    J[0, 6] = c * p['g_Kf'] * mKf**4 * 0.95 * (V - p['E_K'])
+    J[0, 7] = c * p['g_Kf'] * mKf**4 * 0.05 * (V - p['E_K'])
+    J[0, 8] = c * (-g_Na * dE_Na + dI_pump)
+
+    # gates: d/dt x = (xinf(V) - x) / tau(V)
+    def gate(row, x, inf, tau, dtau):
+        xinf, dxinf = inf
+        J[row, 0] = dxinf / tau - (xinf - x) * dtau / tau**2
+        J[row, row] = -1 / tau
+    s, ds = _sig(V, 51.35, -5.98)
+    gate(1, mNaT, _sig(V, 29.13, -8.922), 3.861 - 3.434 * s, -3.434 * ds)
+    s, ds = _sig(V, 21.9, -2.641)
+    gate(2, hNaT, _sig(V, 40.0, 6.048), 2.834 - 2.371 * s, -2.371 * ds)
+    gate(3, mNaP, _sig(V, 48.77, -3.68), 1.0, 0.0)
+    s, ds = _sig(V, -29.83, 3.32)
+    gate(4, n, _sig(V, 12.85, -19.91), 2.03 + 1.96 * s, 1.96 * ds)
+    s, ds = _sig(V, -8.12, 7.96)
+    gate(5, mKf, _sig(V, 17.55, -7.27), 1.94 + 2.66 * s, 2.66 * ds)
+    s, ds = _sig(V, 147.4, 28.66)
+    gate(6, hKf1, _sig(V, 45.0, 6.0), 1.79 + 515.8 * s, 515.8 * ds)
+    gate(7, hKf2, _sig(V, 44.2, 1.5), 116.0, 0.0)
+
+    k = p['NaiSwitch'] * (-1/(p['F']*p['volume']))
+    J[8, 0] = k * g_Na
+    J[8, 1] = k * p['g_NaT'] * 3 * mNaT**2 * hNaT * (V - E_Na)
+    J[8, 2] = k * p['g_NaT'] * mNaT**3 * (V - E_Na)
+    J[8, 3] = k * p['g_NaP'] * (V - E_Na)
+    J[8, 8] = k * (-g_Na * dE_Na + 3 * dI_pump)
+    return J
+
+def currents(y, p):
+    """ the membrane currents (pA) along a (len(t), 9) solution, keyed by name """
+    V, mNaT, hNaT, mNaP, n, mKf, hKf1, hKf2, nai = np.asarray(y).T
+    return dict(I_NaT=I_NaT(V, mNaT, hNaT, nai, p), I_NaP=I_NaP(V, mNaP, nai, p), I_Ks=I_Ks(V, n, p),
+                I_Kf=I_Kf(V, mKf, hKf1, hKf2, p), I_leak_NA=I_leak_NA(V, nai, p), I_leak_K=I_leak_K(V, p),
+                I_pump=p['pumpswitch'] * I_pump(nai, p), E_Na=E_NaSwitch(nai, p))
+
+# =============================================================================
+# Protocols and Checkpoints
+# =============================================================================
+def step_protocol(I_pulse, I_hold=0.0, tHold=5*1000, tPulse=5*1000, tPost=15*1000):
+    """ the step injection of HH_pump_Megwa.PY as [(duration ms, current pA), ...] """
+    return [(tHold, I_hold), (tPulse, I_hold + I_pulse), (tPost, I_hold)]
+
+def add_test_pulses(protocol, amp, start, width=100.0, period=1000.0, stop=None):
+    """
+    protocol with test pulses of amp (pA) and width (ms) added every period from
+    start until stop (default: the end of the protocol). The pulse edges become
+    segment boundaries, so odeint restarts at them like at the step edges.
+    """
+    bounds = np.cumsum([0.0] + [d for d, _ in protocol])
+    stop = bounds[-1] if stop is None else stop
+    on = np.arange(start, stop, period)
+    edges = np.union1d(bounds, np.clip(np.r_[on, on + width], 0, bounds[-1]))
+    out = []
+    for t0, t1 in zip(edges[:-1], edges[1:]):
+        I = protocol[np.searchsorted(bounds, t0, side='right') - 1][1]
+        pulse = amp if np.any((on <= t0) & (t0 < on + width)) else 0.0
+        out.append((float(t1 - t0), _plus(I, pulse)))
+    return out
+
+class Ramp(namedtuple('Ramp', ['slope', 'start', 'stop'])):
+    """ slope (pA/ms) * (t - start) from start to stop, 0 outside """
+    __slots__ = ()
+    hmax = 100.0
+
+    def __call__(self, t):
+        return self.slope * (t - self.start) * ((t >= self.start) & (t < self.stop))
+
+class Zap(namedtuple('Zap', ['amp', 'start', 'duration', 'f0', 'f1'])):
+    """ sine of amplitude amp (pA) from start, its frequency rising linearly from f0 to f1 (Hz) over duration """
+    __slots__ = ()
+
+    @property
+    def hmax(self):
+        return 1000 / (20 * max(self.f0, self.f1, 1.0)) # at least 20 steps per cycle
+
+    def frequency(self, t):
+        """ instantaneous frequency (Hz) """
+        return self.f0 + (self.f1 - self.f0) * np.clip((t - self.start) / self.duration, 0, 1)
+
+    def __call__(self, t):
+        s = (t - self.start) / 1000 # s
+        phase = 2 * np.pi * (self.f0 * s + (self.f1 - self.f0) * s**2 / (2 * self.duration / 1000))
+        return self.amp * np.sin(phase) * ((t >= self.start) & (t < self.start + self.duration))
+
+class Injection(namedtuple('Injection', ['offset', 'injectors'])):
+    """ segment current offset (pA) plus the injectors (callables of t in ms) """
+    __slots__ = ()
+
+    @property
+    def hmax(self):
+        return min(f.hmax for f in self.injectors)
+
+    def __call__(self, t):
+        return self.offset + sum(f(t) for f in self.injectors)
+
+def _plus(I, amp):
+    return Injection(I.offset + amp, I.injectors) if isinstance(I, Injection) else I + amp
+
+def add_injectors(protocol, *injectors):
+    """
+    protocol with the time-dependent injectors (e.g. Ramp, Zap) added to every
+    segment's current. Apply after add_test_pulses.
+    """
+    return [(d, Injection(I, injectors)) for d, I in protocol]
+
+def injected(protocol, t):
+    """ the injected current (pA) of protocol at times t (ms), e.g. to plot it """
+    t = np.asarray(t, dtype=float)
+    bounds = np.cumsum([0.0] + [d for d, _ in protocol])
+    seg = np.clip(np.searchsorted(bounds, t, side='right') - 1, 0, len(protocol) - 1)
+    I = np.zeros(t.shape)
+    for k, (_, I_k) in enumerate(protocol):
+        sel = seg == k
+        I[sel] = I_k(t[sel]) if callable(I_k) else I_k
+    return I
+
+PumpCheckpoint = namedtuple('PumpCheckpoint', ['segment', 't', 'y'])
+""" state y at time t, before protocol segment number `segment` """
+
+_ODEINT_LOCK = threading.Lock()
+""" odeint (LSODA) keeps its state in globals and is not re-entrant across threads """
+
+def simulate(protocol, p=DEFAULTS, dt=.05, checkpoint=None, stop=None, rtol=1e-10, jac=False):
+    """
+    Integrate protocol segments from checkpoint.segment (default: from t=0 at param0)
+    up to, not including, segment `stop` (default: all).
+
+    Returns (t, y, checkpoints): the time points, the (len(t), 9) states and the
+    PumpCheckpoint at every segment boundary passed, the last one being where the
+    run ended. The segment start points are shared, so t/y from a checkpoint
+    continue the arrays of the run that produced it after dropping its last point.
+    With jac=True odeint uses the analytical Jacobian.
+    """
+    if checkpoint is None:
+        checkpoint = PumpCheckpoint(0, 0.0, param0)
+    if stop is None:
+        stop = len(protocol)
+    inv_dt = int(round(1/dt))
+    t0, y0 = checkpoint.t, checkpoint.y
+    ts, ys = [np.array([t0])], [np.array([y0])]
+    checkpoints = []
+    for k in range(checkpoint.segment, stop):
+        duration, I = protocol[k]
+        t_seg = t0 + np.arange(int(round(duration*inv_dt)) + 1) / inv_dt
+        with _ODEINT_LOCK:
+            y_seg = odeint(dALLdt, y0, t_seg, args=(p, I), Dfun=jacobian if jac else None,
+                           rtol=rtol, h0=.05, hmax=min(100.0, getattr(I, 'hmax', 100.0)))
+        ts.append(t_seg[1:])
+        ys.append(y_seg[1:])
+        t0, y0 = t_seg[-1], y_seg[-1]
+        checkpoints.append(PumpCheckpoint(k + 1, t0, y0))
+    return np.concatenate(ts), np.concatenate(ys), checkpoints
+
+def save_checkpoint(filename, checkpoint):
+    np.savez(filename, segment=checkpoint.segment, t=checkpoint.t, y=checkpoint.y)
+
+def load_checkpoint(filename):
+    c = np.load(filename)
+    return PumpCheckpoint(int(c['segment']), float(c['t']), c['y'])
+
+def run_branches(protocols, n_prefix, p=DEFAULTS, dt=.05):
+    """
+    Simulate protocols that share their first n_prefix segments (e.g. the hold
+    period of step protocols with different I_pulse). The prefix is integrated
+    once; returns one (t, y) per protocol, each identical to simulate(protocol).
+    """
+    t_pre, y_pre, cps = simulate(protocols[0], p, dt, stop=n_prefix)
+    out = []
+    for protocol in protocols:
+        assert protocol[:n_prefix] == protocols[0][:n_prefix], 'protocols differ inside the prefix'
+        t, y, _ = simulate(protocol, p, dt, checkpoint=cps[-1] if cps else None)
+        out.append((np.concatenate([t_pre[:-1], t]), np.concatenate([y_pre[:-1], y])))
+    return out
+
+def simulate_cached(cache, protocol, p=DEFAULTS, dt=.05, rtol=1e-10, features=None):
+    """
+    simulate() from t=0 through a simcache.SimCache. features(t, y) -> dict is
+    evaluated on the new or cached traces (and stored on a miss). Returns the
+    cache result dict with 't', 'y' and 'features'.
+    """
+    key = cache.key('pump', p, protocol, dict(dt=dt, rtol=rtol, y0=param0), SOURCES)
+    def compute():
+        t, y, _ = simulate(protocol, p, dt, rtol=rtol)
+        return dict(t=t, y=y)
+    return cache.cached(key, compute, None if features is None else lambda r: features(r['t'], r['y']))
+
+# =============================================================================
+# Features
+# =============================================================================
+def features(t, y, p, tHold=5*1000, tPulse=5*1000, spike_height=-25):
+    """
+    The per-sweep measurements of HH_pump_Megwa.PY for a step protocol (injection
+    from tHold to tHold+tPulse). Undefined values (too few spikes) are nan.
+    """
+    dt = t[1] - t[0]
+    tPulseEnd = tHold + tPulse
+    idx = lambda time: int(np.searchsorted(t, time - dt/2))
+    Vcell, Nai = y[:, 0], y[:, 8]
+    f = {}
+
+    # baseline 50 ms before injection
+    V_preinj = Vcell[idx(tHold - 50)]
+    f['pre_voltage'] = V_preinj
+    f['pre_nai'] = Nai[idx(tHold - 50)]
+    f['pre_ena'] = 25.694 * np.log(p['nao']/f['pre_nai'])
+    f['pre_pump'] = I_pump(f['pre_nai'], p)
+
+    # AHP after the injection: trough, amplitude and time to recover 25/50/75%
+    vmin_idx = idx(tPulseEnd) + int(np.argmin(Vcell[idx(tPulseEnd):]))
+    f['vmin'] = Vcell[vmin_idx]
+    f['ahp_amp'] = f['vmin'] - V_preinj
+    for name, frac in (('ahp25', 0.25), ('ahp50', 0.5), ('ahp75', 0.75)):
+        f[name] = np.argmax(Vcell[vmin_idx:] > f['vmin'] - f['ahp_amp'] * frac) * dt
+
+    # spikes after the stimulus starts, ISIs and instantaneous firing rates (Hz)
+    peaks, _ = find_peaks(Vcell, height=spike_height)
+    spktimes = t[peaks]
+    spktimes = spktimes[spktimes >= tHold]
+    f['n_spikes'] = len(spktimes)
+    spk_s = spktimes / 1000
+    ifr = 1 / np.diff(spk_s) if len(spktimes) > 1 else np.array([0.0])
+    f['f0_ifr'] = ifr[0]
+    f['mean_ifr'] = np.mean(ifr) if len(spktimes) > 1 else 0.0
+    f['final_ifr'] = ifr[-1]
+    f['delay'] = spktimes[0] - tHold if len(spktimes) else 0.0
+
+    # mean voltage of the troughs during the injection (F-V curve)
+    trough_idx = signal.argrelextrema(Vcell, np.less)[0]
+    trough_idx = trough_idx[(trough_idx > idx(tHold)) & (trough_idx < idx(tPulseEnd))]
+    f['mean_trough'] = np.mean(Vcell[trough_idx]) if len(trough_idx) else Vcell[idx(tPulseEnd - 100)]
+
+    # adaptation slope between the averages of the last two groups of 9 IFRs
+    mean_or_nan = lambda a: np.mean(a) if len(a) else np.nan
+    f['g9_avg'] = mean_or_nan(ifr[-10:-1])
+    f['g19_avg'] = mean_or_nan(ifr[-19:-10])
+    f['adapt_slope'] = ((f['g19_avg'] - f['g9_avg']) / (spk_s[-15] - spk_s[-6])
+                        if len(spk_s) >= 15 else np.nan)
+
+    # spiking integrity: % of the injection with spiking
+    f['spk_int'] = (spktimes[-1] - tHold) / tPulse * 100 if len(spktimes) else 0.0
+    return f
+
+# =============================================================================
+# Model Object
+# =============================================================================
+class PumpModel:
+    """
+    One pump model configuration. Holds only its parameter record and solver
+    settings, so instances are independent and cheap to create or pickle.
+
+    model = PumpModel(naih=50e-3, Imaxpump=100.0)
+    t, y, _ = model.simulate(step_protocol(50.0))
+    model.features(t, y)
+    """
+    __slots__ = ('params', 'dt', 'rtol', 'jac')
+
+    def __init__(self, params=None, dt=.05, rtol=1e-10, jac=False, **overrides):
+        params = PumpParams() if params is None else params
+        self.params = params.replace(**overrides) if overrides else params
+        self.dt, self.rtol, self.jac = dt, rtol, jac
+
+    def __getstate__(self):
+        return (self.params, self.dt, self.rtol, self.jac)
+
+    def __setstate__(self, state):
+        self.params, self.dt, self.rtol, self.jac = state
+
+    def __repr__(self):
+        return 'PumpModel(%r, dt=%r)' % (self.params, self.dt)
+
+    def rhs(self, y, t=0.0, I_inj=0.0):
+        return dALLdt(y, t, self.params, I_inj)
+
+    def jacobian(self, y, t=0.0, I_inj=0.0):
+        return jacobian(y, t, self.params, I_inj)
+
+    def currents(self, y):
+        return currents(y, self.params)
+
+    def simulate(self, protocol, checkpoint=None, stop=None):
+        return simulate(protocol, self.params, self.dt, checkpoint, stop, self.rtol, self.jac)
+
+    def features(self, t, y, tHold=5*1000, tPulse=5*1000):
+        return features(t, y, self.params, tHold, tPulse)
+
+def _simulate_one(args):
+    model, protocol = args
+    return model.simulate(protocol)
+
+def simulate_many(models, protocol, processes=None):
+    """
+    model.simulate(protocol) for every PumpModel in models, in a pool of worker
+    processes (default: one per CPU). Returns the (t, y, checkpoints) tuples in
+    the order of models. Workers are forked where the platform allows, so
+    scripts without a __main__ guard (HH_pump_Megwa.PY) are not re-run in them.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    ctx = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    with ProcessPoolExecutor(processes, mp_context=ctx) as pool:
+        return list(pool.map(_simulate_one, [(m, protocol) for m in models]))
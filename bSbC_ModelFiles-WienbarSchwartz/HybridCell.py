@@ -1,15 +1,24 @@
 # imports
 import os
 # os.chdir('C:/Users/Documents/Schwartz/NEURON/bSbC Paper Model/')
-import csv
-import numpy
-import scipy.io
-
+import neuron
 from neuron import h
-from neuron.units import ms, mV
-from neuron import gui
+# no `from neuron import gui` here: the class never needs InterViews and batch
+# workers have no display. Interactive scripts import gui themselves.
 
 h.load_file('stdrun.hoc')
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_mechanisms(model_dir=MODEL_DIR):
+    # load the compiled na12/na16/kv mechanisms from the model directory rather than
+    # relying on NEURON's automatic load from the current working directory
+    if hasattr(h, 'na12'): # already loaded (e.g. auto-loaded because cwd is model_dir)
+        return True
+    return neuron.load_mechanisms(model_dir, warn_if_already_loaded=False)
+
+load_mechanisms()
+
 temp = 32
 h.celsius = temp
 dt = 0.01
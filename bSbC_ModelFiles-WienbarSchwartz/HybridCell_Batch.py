@@ -0,0 +1,224 @@
+# Headless batch entry point for the HybridCell contrast-response runs.
+#
+# Same protocol as HybridCell_ContrastResp.py, but meant for worker processes on a
+# cluster: only neuron.h + stdrun are imported (no gui / Tk), mechanisms are loaded
+# from the model directory (see HybridCell.load_mechanisms), matplotlib is only
+# imported when --plot is given, and the time from process start to the first
+# integration step is reported so startup cost can be tracked. Process start is
+# the exec of the interpreter (/proc/self/stat, or psutil off Linux), so the
+# interpreter's own startup counts; the time since this script's first line is
+# reported next to it.
+#
+# usage:
+#   python HybridCell_Batch.py --conductances <dir> [--out file.mat] [--plot] [--cache <dir>] [--store <dir>]
+#
+# With --cache, each cell's soma voltage is stored in a simcache.SimCache (repo root)
+# keyed by the cell parameters, conductance waveforms, dt, temperature and the
+# contents of HybridCell.py and the .mod files; cells whose key is already cached
+# are not built or simulated at all.
+#
+# With --store, each cell becomes one row of a results_store.ResultsStore (repo root),
+# indexed by its HybridCell parameters and the conductance factor, with spike count
+# and mean voltage as columns and the soma voltage as its trace. Runs with different
+# parameters append to the same store instead of overwriting one .mat file.
+
+import time
+T_START = time.perf_counter() # first line of the script, after interpreter startup
+
+import os
+import sys
+import glob
+import argparse
+import numpy
+
+from neuron import h
+from neuron.units import ms, mV
+
+from HybridCell import HybridCell, MODEL_DIR
+
+temp = 32
+h.celsius = temp
+
+vLeak = -60
+v_init = -61.5
+NaVRatio = [0.4, 0]
+NaDensity =  [0.003452431, 0.002592035]
+KDensity = 0.003873771
+SomaDiam = 17.5
+DendLen = 508
+HillLen = 24
+AISLen = [22, 16]
+Multiplier = 30
+Factor = .4
+
+DT = 1/10 # ms
+TSTOP = 2500 # ms
+
+# baseline cells of the contrast-response scripts, as HybridCell keyword arguments
+OFFsA_PARAMS = dict(v_init=vLeak, NaVRatio=NaVRatio[0], Multiplier=Multiplier, NaDensity=NaDensity[0],
+                    KDensity=KDensity, SomaDiam=SomaDiam, DendLen=DendLen, HillLen=HillLen, AISLen=AISLen[0])
+bSbC_PARAMS = dict(v_init=vLeak, NaVRatio=NaVRatio[1], Multiplier=Multiplier, NaDensity=NaDensity[1],
+                   KDensity=KDensity, SomaDiam=SomaDiam, DendLen=DendLen, HillLen=HillLen, AISLen=AISLen[1])
+
+# conductance files on the rig drive
+CONDUCTANCE_DIR = "Z:/Rig_Related/Dynamic Clamp/Conductances/SRW_bSbCproject/"
+CONDUCTANCE_FILES = dict(Alpha_Exc='Sophia_Alpha_cm100_Exc', Alpha_Inh='Sophia_Alpha_cm100_Inh',
+                         bSbC_Exc='Sophia_Bursty_cm100_Exc', bSbC_Inh='Sophia_Bursty_cm100_Inh')
+
+
+# files defining the model, for simcache keys
+SOURCES = [os.path.join(MODEL_DIR, 'HybridCell.py')] + sorted(glob.glob(os.path.join(MODEL_DIR, '*.mod')))
+
+
+def cache_key(cache, params, exc, inh, factor=Factor, tstop=TSTOP, v0=-60):
+    # simcache key of one dynamic-clamp run of a cell (exc/inh: conductances in nS)
+    return cache.key('HybridCell', params,
+                     dict(exc=numpy.asarray(exc), inh=numpy.asarray(inh), factor=factor, tstop=tstop, v0=v0),
+                     dict(dt=DT, celsius=h.celsius, method='fixed'), SOURCES)
+
+
+STORE_INDEX = ['NaVRatio', 'NaDensity', 'KDensity', 'SomaDiam', 'DendLen', 'HillLen', 'AISLen', 'Multiplier', 'factor']
+
+
+def store_row(name, params, v, factor=Factor, tstop=TSTOP):
+    # results_store row of one cell's run
+    v = numpy.asarray(v)
+    n_spikes = int(numpy.count_nonzero((v[:-1] < 0) & (v[1:] >= 0)))
+    return dict(params, cell=name, factor=factor, tstop=tstop, dt=DT, celsius=h.celsius,
+                n_spikes=n_spikes, mean_v=float(v.mean()))
+
+
+def load_conductances(filepath=CONDUCTANCE_DIR):
+    # returns the raw conductance waveforms (nS) keyed like CONDUCTANCE_FILES
+    import scipy.io # only needed when reading from disk
+    return {key: scipy.io.loadmat(os.path.join(filepath, name + '.mat'))['conductances'][0]
+            for key, name in CONDUCTANCE_FILES.items()}
+
+
+def conductance_to_rs(g, factor=Factor):
+    # SEClamp series resistance (MOhm) from a conductance waveform (nS)
+    return h.Vector(1000/numpy.asarray(g)) * factor
+
+
+def attach_dynamic_clamp(cell, exc_rs, inh_rs, dt=DT):
+    # excitatory (0 mV) and inhibitory (-70 mV) SEClamps on the soma, rs played from the vectors
+    E = h.SEClamp(cell.soma(0.4))
+    E.dur1 = 1e9
+    E.amp1 = 0 # set to reversal potential
+    I = h.SEClamp(cell.soma(0.6))
+    I.dur1 = 1e9
+    I.amp1 = -70
+    exc_rs.play(E._ref_rs, dt)
+    inh_rs.play(I._ref_rs, dt)
+    cell.played = (exc_rs, inh_rs) # playback stops if the vectors are garbage collected
+    return E, I
+
+
+def since_process_start():
+    # seconds since the process started: from its start time in /proc/self/stat
+    # (clock ticks since boot) on Linux, psutil elsewhere; None if neither works
+    try:
+        with open('/proc/self/stat') as f:
+            stat = f.read()
+        ticks = int(stat[stat.rindex(')') + 2:].split()[19]) # field 22, starttime
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return time.time() - psutil.Process().create_time()
+
+
+def run(tstop=TSTOP, v0=-60):
+    # run to tstop; returns seconds from process start and from the script's first
+    # line (T_START) to the end of the first step
+    h.finitialize(v0 * mV)
+    h.fadvance()
+    first_step = since_process_start(), time.perf_counter() - T_START
+    h.continuerun(tstop * ms)
+    return first_step
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='headless HybridCell contrast-response run')
+    parser.add_argument('--conductances', default=CONDUCTANCE_DIR, help='directory with the Sophia_*_cm100_*.mat files')
+    parser.add_argument('--factor', type=float, default=Factor)
+    parser.add_argument('--tstop', type=float, default=TSTOP, help='ms')
+    parser.add_argument('--out', default=None, help='save voltages to this .mat file')
+    parser.add_argument('--plot', action='store_true', help='plot the soma voltages (imports matplotlib)')
+    parser.add_argument('--cache', default=None, help='simulation cache directory')
+    parser.add_argument('--store', default=None, help='results store directory to append the runs to')
+    args = parser.parse_args(argv)
+
+    g = load_conductances(args.conductances)
+    # each cell gets the other type's conductances, as in HybridCell_ContrastResp.py
+    runs = [('OFFsA', OFFsA_PARAMS, g['bSbC_Exc'], g['bSbC_Inh']),
+            ('bSbC', bSbC_PARAMS, g['Alpha_Exc'], g['Alpha_Inh'])]
+    SomaV, keys = {}, {}
+    if args.cache:
+        sys.path.append(os.path.join(MODEL_DIR, '..'))
+        from simcache import SimCache
+        cache = SimCache(args.cache)
+        for name, params, exc, inh in runs:
+            keys[name] = cache_key(cache, params, exc, inh, args.factor, args.tstop)
+            result = cache.get(keys[name])
+            if result is not None:
+                SomaV[name] = result['v']
+
+    todo = [r for r in runs if r[0] not in SomaV]
+    if todo:
+        h.dt = DT
+        cells, recs = [], []
+        for name, params, exc, inh in todo:
+            cell = HybridCell(**params)
+            attach_dynamic_clamp(cell, conductance_to_rs(exc, args.factor), conductance_to_rs(inh, args.factor))
+            cells.append(cell)
+            recs.append(h.Vector().record(cell.soma(0.5)._ref_v))
+        first_step, in_script = run(args.tstop)
+        if first_step is not None:
+            print('start-to-first-step: %.3f s' % first_step)
+        print('script-to-first-step: %.3f s' % in_script)
+        for (name, params, exc, inh), rec in zip(todo, recs):
+            SomaV[name] = numpy.array(rec)
+            if args.cache:
+                cache.put(keys[name], dict(v=SomaV[name]))
+    else:
+        first_step = None
+    since_start = since_process_start()
+    if since_start is not None:
+        print('total: %.3f s' % since_start)
+    print('total in script: %.3f s' % (time.perf_counter() - T_START))
+    if args.cache:
+        print('cache:', cache.stats())
+    SomaV_A, SomaV_B = SomaV['OFFsA'], SomaV['bSbC']
+
+    TimeVec = numpy.arange(len(SomaV_A)) * DT / 1000 # s
+    if args.store:
+        sys.path.append(os.path.join(MODEL_DIR, '..'))
+        from results_store import ResultsStore
+        with ResultsStore(args.store, index=STORE_INDEX, flush_every=len(runs)) as store:
+            for name, params, exc, inh in runs:
+                store.append(store_row(name, params, SomaV[name], args.factor, args.tstop), traces=dict(v=SomaV[name]))
+    if args.out:
+        import scipy.io
+        scipy.io.savemat(args.out, dict(OFFsA = numpy.array(SomaV_A), bSbC = numpy.array(SomaV_B), TimeVec = TimeVec))
+    if args.plot:
+        import matplotlib.pyplot as plt
+        plt.figure(1)
+        plt.plot(TimeVec, list(SomaV_A))
+        plt.xlabel('t (s)')
+        plt.ylabel('v (mV)')
+        plt.title('OFFsA, bSbC Conductances')
+        plt.figure(2)
+        plt.plot(TimeVec, list(SomaV_B))
+        plt.xlabel('t (s)')
+        plt.ylabel('v (mV)')
+        plt.title('bSbC, OFFsA Conductances')
+        plt.show()
+    return first_step
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Checkpoint / restore of NEURON simulation state for HybridCell protocols.
+#
+# Long runs that share a common pre-conditioning prefix (e.g. the first 2.5 s of
+# conductance playback) only need that prefix simulated once: run it, take a
+# Checkpoint, then for every branch restore the checkpoint, change whatever differs
+# after the prefix (clamp amplitudes, played vectors, gbar values...) and continue.
+# With the fixed-step solver, prefix + branch is bit-identical to an uninterrupted
+# run to the same tstop.
+#
+# Uses h.SaveState, which stores STATE variables, t and event queues but not
+# PARAMETERs, so the model structure must not change between save and restore.
+#
+# example:
+#   h.finitialize(-60 * mV)
+#   h.continuerun(2500 * ms)
+#   cp = Checkpoint()
+#   for amp in amps:
+#       cp.restore()
+#       clamp.amp1 = amp
+#       h.continuerun(5000 * ms)
+#       traces.append(cp.join(rec))
+
+import numpy
+
+from neuron import h
+from neuron.units import mV
+
+h.load_file('stdrun.hoc')
+
+
+class Checkpoint:
+    def __init__(self, records=(), v_init=-60):
+        # snapshot the current simulation state; records are the h.Vectors recording
+        # the prefix, kept so branch traces can be joined to it (see join)
+        self.v_init = v_init
+        self.t = h.t
+        self.state = h.SaveState()
+        self.state.save()
+        self.prefix = [numpy.array(vec) for vec in records]
+
+    def restore(self):
+        # put the simulation back at the checkpoint; record vectors restart at self.t
+        h.finitialize(self.v_init * mV) # also re-initializes Vector.play/record
+        self.state.restore()
+        if h.cvode.active():
+            h.cvode.re_init()
+        h.frecord_init()
+
+    def join(self, vec, i=0):
+        # prefix trace i + the branch trace recorded in vec since restore()
+        # (the first branch point duplicates the last prefix point)
+        return numpy.concatenate([self.prefix[i][:-1], numpy.array(vec)])
+
+    def write(self, filename):
+        # save to disk so a prefix can be shared between processes with the same model
+        f = h.File(filename)
+        f.wopen()
+        self.state.fwrite(f)
+        f.close()
+        numpy.savez(filename + '.npz', t=self.t, v_init=self.v_init, *self.prefix)
+
+    @classmethod
+    def read(cls, filename):
+        # the model must already be built exactly as when the checkpoint was written
+        cp = cls.__new__(cls)
+        cp.state = h.SaveState()
+        f = h.File(filename)
+        f.ropen()
+        cp.state.fread(f)
+        f.close()
+        meta = numpy.load(filename + '.npz')
+        cp.t = float(meta['t'])
+        cp.v_init = float(meta['v_init'])
+        cp.prefix = [meta['arr_%d' % i] for i in range(len(meta.files) - 2)]
+        return cp
+
+
+def run_branches(prefix_tstop, tstop, branches, records=(), v_init=-60):
+    # simulate 0..prefix_tstop once, then for each callable in branches: restore,
+    # call it (to apply the branch's changes) and run on to tstop.
+    # returns, per branch, the full 0..tstop traces of every vector in records
+    h.finitialize(v_init * mV)
+    h.continuerun(prefix_tstop)
+    cp = Checkpoint(records, v_init)
+    results = []
+    for apply_branch in branches:
+        cp.restore()
+        apply_branch()
+        h.continuerun(tstop)
+        results.append([cp.join(vec, i) for i, vec in enumerate(records)])
+    return results
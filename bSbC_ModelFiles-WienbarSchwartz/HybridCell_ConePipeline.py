@@ -0,0 +1,129 @@
+# Stimulus -> cone photocurrent -> synaptic conductances -> HybridCell dynamic clamp,
+# streamed chunk by chunk in one process.
+#
+# The cone model (../Photorreceptors/cone_model.py) streams photocurrent chunks, a
+# TransferStage per synapse turns them into conductance waveforms (linear gain
+# around a resting conductance, first-order synaptic low-pass, rectification), and
+# DynamicClampStream feeds those into the excitatory/inhibitory SEClamps of a
+# HybridCell exactly as the contrast-response scripts do with the .mat files
+# (rs = 1000/g * Factor), returning soma voltage and spike times per chunk.
+# Nothing is written to disk and memory is bounded by the chunk size.
+#
+# The clamp rs is set before every step from Python, which reproduces
+# Vector.play(ref, dt) of the full waveform exactly without holding it in memory
+# (re-registering Vector.play per chunk mid-run does not).
+#
+# usage:
+#   python HybridCell_ConePipeline.py --stimulus stim.npy [--stim-dt 0.001]
+
+import os
+import sys
+import argparse
+import numpy
+from scipy.signal import lfilter
+
+from neuron import h
+from neuron.units import mV
+
+from HybridCell import HybridCell, MODEL_DIR
+from HybridCell_Batch import OFFsA_PARAMS, Factor
+
+sys.path.append(os.path.join(MODEL_DIR, '..', 'Photorreceptors'))
+import cone_model
+
+h.load_file('stdrun.hoc')
+
+
+class TransferStage:
+    def __init__(self, gain, g0, tau, dt, I0=None, g_min=1e-3):
+        # photocurrent (pA) -> conductance (nS): g = max(g_min, lowpass(g0 + gain*(I - I0)))
+        # gain in nS/pA (negative for OFF pathways: light makes the photocurrent less
+        # negative), tau the synaptic low-pass time constant and dt the photocurrent
+        # sample spacing, both in s. I0 defaults to the dark photocurrent.
+        self.gain, self.g0, self.g_min = gain, g0, g_min
+        self.I0 = cone_model.photocurrent(cone_model.dark_state()) if I0 is None else I0
+        a = numpy.exp(-dt / tau)
+        self.b, self.a = [1 - a], [1, -a]
+        self.zi = None
+
+    def __call__(self, photocurrent):
+        drive = self.g0 + self.gain * (numpy.asarray(photocurrent) - self.I0)
+        if self.zi is None: # start at steady state for the first sample
+            self.zi = numpy.array([drive[0] * -self.a[1]])
+        g, self.zi = lfilter(self.b, self.a, drive, zi=self.zi)
+        return numpy.maximum(g, self.g_min)
+
+
+class DynamicClampStream:
+    def __init__(self, cell, factor=Factor, dt=1/10, v_init=-60, thresh=-20):
+        # excitatory (0 mV) and inhibitory (-70 mV) SEClamps on the soma, as in the
+        # contrast-response scripts, plus a spike detector on the soma
+        self.cell, self.factor, self.dt, self.v_init = cell, factor, dt, v_init
+        self.E = h.SEClamp(cell.soma(0.4))
+        self.E.dur1 = 1e9
+        self.E.amp1 = 0 # set to reversal potential
+        self.I = h.SEClamp(cell.soma(0.6))
+        self.I.dur1 = 1e9
+        self.I.amp1 = -70
+        self.spikes = h.Vector()
+        self.nc = h.NetCon(cell.soma(0.5)._ref_v, None, sec=cell.soma)
+        self.nc.threshold = thresh
+        self.nc.record(self.spikes)
+        self.started = False
+
+    def feed(self, g_exc, g_inh):
+        # advance one step per conductance sample (nS, sampled at self.dt); returns the
+        # soma voltage after each step and the spike times (ms) in this chunk
+        rs_exc = 1000 / numpy.asarray(g_exc) * self.factor # needs to be in MOhms
+        rs_inh = 1000 / numpy.asarray(g_inh) * self.factor
+        if not self.started:
+            h.dt = self.dt
+            self.E.rs, self.I.rs = rs_exc[0], rs_inh[0]
+            h.finitialize(self.v_init * mV)
+            self.started = True
+        n_spikes = len(self.spikes)
+        v = numpy.empty(len(rs_exc))
+        seg = self.cell.soma(0.5)
+        for i in range(len(rs_exc)):
+            self.E.rs = rs_exc[i]
+            self.I.rs = rs_inh[i]
+            h.fadvance()
+            v[i] = seg.v
+        spikes = numpy.array(self.spikes)[n_spikes:]
+        self.spikes.resize(0)
+        return v, spikes
+
+
+def run_pipeline(stimulus_chunks, clamp, stim_dt, exc, inh, cone_params=cone_model.PARAMS):
+    # generator: for each stimulus chunk (light intensity, spacing stim_dt in s) yields
+    # (g_exc, g_inh, v, spikes) with conductances and v at the NEURON step clamp.dt
+    upsample = int(round(stim_dt * 1000 / clamp.dt))
+    assert abs(upsample * clamp.dt - stim_dt * 1000) < 1e-9, 'stim_dt must be a multiple of the NEURON dt'
+    for I in cone_model.stream(stimulus_chunks, stim_dt, cone_params):
+        g_exc = numpy.repeat(exc(I), upsample)
+        g_inh = numpy.repeat(inh(I), upsample)
+        v, spikes = clamp.feed(g_exc, g_inh)
+        yield g_exc, g_inh, v, spikes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='cone model -> HybridCell dynamic clamp, streamed')
+    parser.add_argument('--stimulus', required=True, help='1-D light intensity .npy (memory-mapped)')
+    parser.add_argument('--stim-dt', type=float, default=0.001, help='stimulus sample spacing (s)')
+    parser.add_argument('--chunk', type=int, default=1000, help='stimulus samples per chunk')
+    args = parser.parse_args(argv)
+
+    h.celsius = 32
+    cell = HybridCell(**OFFsA_PARAMS)
+    clamp = DynamicClampStream(cell)
+    # OFF excitation, ON (crossover) inhibition
+    exc = TransferStage(gain=-0.5, g0=2.0, tau=0.01, dt=args.stim_dt)
+    inh = TransferStage(gain=0.3, g0=2.0, tau=0.02, dt=args.stim_dt)
+    n_spikes = 0
+    for g_exc, g_inh, v, spikes in run_pipeline(cone_model.memmap_chunks(args.stimulus, args.chunk), clamp, args.stim_dt, exc, inh):
+        n_spikes += len(spikes)
+    print('%d spikes in %.1f s' % (n_spikes, h.t / 1000))
+
+
+if __name__ == '__main__':
+    main()
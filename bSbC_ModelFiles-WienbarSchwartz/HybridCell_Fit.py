@@ -0,0 +1,174 @@
+# Fit HybridCell densities / geometry to recorded voltage traces.
+#
+# The baseline parameters in the contrast-response scripts (NaDensity, KDensity,
+# AISLen, ...) were matched to Voltages_ContrastResponse_matched.mat by hand. This
+# searches them with differential evolution (scipy.optimize.differential_evolution):
+# each generation's candidates are simulated in parallel worker processes, each of
+# which builds NEURON and converts the conductances to clamp resistances once.
+# Candidates are rounded to `decimals` significant digits and memoised, so
+# duplicates (common once the population converges, and across restarts with
+# --cache) are never re-simulated. Cache entries are keyed by a hash of the fit
+# context as well (baseline cell, fitted names, conductances, target, spike weight,
+# tstop, dt and temperature), so a --cache file shared between fits only answers
+# candidates of the same fit.
+#
+# Cost: rms voltage error against the target trace (in units of 10 mV) plus the
+# relative error in spike count, weighted by --spike-weight.
+#
+# usage:
+#   python HybridCell_Fit.py --cell OFFsA --conductances <dir> [--workers 8] [--cache fit_cache.jsonl]
+
+import os
+import json
+import hashlib
+import argparse
+import multiprocessing
+import numpy
+from scipy.optimize import differential_evolution
+
+from neuron import h
+from neuron.units import mV
+
+import HybridCell_Batch as batch
+from HybridCell import HybridCell, MODEL_DIR
+
+# name: (lower, upper) bounds of the fitted HybridCell arguments; the rest are
+# taken from the baseline cell
+FIT_BOUNDS = dict(NaDensity=(0.001, 0.006), KDensity=(0.001, 0.008), AISLen=(10, 40))
+TARGET_FILE = os.path.join(MODEL_DIR, 'Voltages_ContrastResponse_matched.mat')
+SPIKE_THRESH = -20 # mV
+
+
+def spike_count(v, thresh=SPIKE_THRESH):
+    v = numpy.asarray(v)
+    return int(numpy.sum((v[1:] >= thresh) & (v[:-1] < thresh)))
+
+
+def cost(v, target, spike_weight=1.0):
+    n = min(len(v), len(target))
+    rms = numpy.sqrt(numpy.mean((numpy.asarray(v[:n]) - target[:n])**2)) / 10
+    n_target = spike_count(target)
+    return rms + spike_weight * abs(spike_count(v) - n_target) / max(n_target, 1)
+
+
+# ---- worker side ----
+_WORKER = {}
+
+def _init_worker(base, names, exc, inh, target, spike_weight, tstop):
+    # runs once per worker process; the rs vectors are replayed into every candidate's clamps
+    h.celsius = batch.temp
+    _WORKER.update(base=base, names=names, exc_rs=batch.conductance_to_rs(exc), inh_rs=batch.conductance_to_rs(inh),
+                   target=target, spike_weight=spike_weight, tstop=tstop)
+
+
+def evaluate(x):
+    w = _WORKER
+    params = dict(w['base'], **dict(zip(w['names'], x)))
+    h.dt = batch.DT
+    cell = HybridCell(**params)
+    cell.clamps = batch.attach_dynamic_clamp(cell, w['exc_rs'], w['inh_rs']) # kept alive for the run
+    v = h.Vector().record(cell.soma(0.5)._ref_v)
+    h.finitialize(-60 * mV)
+    h.continuerun(w['tstop'])
+    return cost(numpy.array(v), w['target'], w['spike_weight'])
+
+
+# ---- parent side ----
+def fit_context(*parts):
+    # short sha256 of everything besides the candidate that the cost depends on
+    digest = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, numpy.ndarray):
+            digest.update(numpy.ascontiguousarray(p, dtype=float).tobytes())
+        else:
+            digest.update(json.dumps(p, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:16]
+
+
+class CachedMap:
+    def __init__(self, pool, decimals=4, cache_file=None, context=''):
+        # map-like for differential_evolution(workers=...): rounds candidates to
+        # `decimals` significant digits, answers known ones (of the same fit
+        # context) from the cache and sends the unique rest to the pool
+        self.pool, self.decimals, self.cache_file, self.context = pool, decimals, cache_file, context
+        self.cache = {}
+        self.hits = self.misses = 0
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file) as f:
+                for line in f:
+                    rec = json.loads(line)
+                    self.cache[(rec.get('context'),) + tuple(rec['x'])] = rec['cost']
+
+    def round(self, x):
+        return tuple(float('%.*g' % (self.decimals, xi)) for xi in x)
+
+    def key(self, x):
+        return (self.context,) + self.round(x)
+
+    def __call__(self, func, iterable):
+        # func is ignored: candidates always go through evaluate() in the workers
+        keys = [self.key(x) for x in iterable]
+        todo = list(dict.fromkeys(k for k in keys if k not in self.cache))
+        self.hits += len(keys) - len(todo)
+        self.misses += len(todo)
+        for k, c in zip(todo, self.pool.map(evaluate, [k[1:] for k in todo])):
+            self.cache[k] = c
+            if self.cache_file:
+                with open(self.cache_file, 'a') as f:
+                    f.write(json.dumps(dict(context=k[0], x=k[1:], cost=c)) + '\n')
+        return [self.cache[k] for k in keys]
+
+
+def fit(base, exc, inh, target, bounds=FIT_BOUNDS, workers=None, popsize=15, maxiter=50,
+        decimals=4, cache_file=None, spike_weight=1.0, tstop=batch.TSTOP, seed=None):
+    # returns (best parameter dict, scipy OptimizeResult, CachedMap)
+    names = list(bounds)
+    context = fit_context(base, names, numpy.asarray(exc), numpy.asarray(inh), numpy.asarray(target),
+                          spike_weight, tstop, batch.DT, batch.temp)
+    ctx = multiprocessing.get_context('spawn') # fresh NEURON per worker
+    with ctx.Pool(workers, initializer=_init_worker,
+                  initargs=(base, names, exc, inh, target, spike_weight, tstop)) as pool:
+        cmap = CachedMap(pool, decimals, cache_file, context)
+        res = differential_evolution(lambda x: None, [bounds[n] for n in names], workers=cmap,
+                                     updating='deferred', popsize=popsize, maxiter=maxiter,
+                                     polish=False, seed=seed)
+    best = dict(base, **dict(zip(names, cmap.round(res.x))))
+    return best, res, cmap
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='fit HybridCell parameters to a recorded voltage trace')
+    parser.add_argument('--cell', choices=['OFFsA', 'bSbC'], default='OFFsA')
+    parser.add_argument('--target', default=TARGET_FILE, help='.mat with OFFsA/bSbC voltage traces')
+    parser.add_argument('--conductances', default=batch.CONDUCTANCE_DIR)
+    parser.add_argument('--workers', type=int, default=None, help='default: all cores')
+    parser.add_argument('--popsize', type=int, default=15)
+    parser.add_argument('--maxiter', type=int, default=50)
+    parser.add_argument('--decimals', type=int, default=4, help='significant digits of the cache key')
+    parser.add_argument('--cache', default=None, help='jsonl file to persist evaluated candidates')
+    parser.add_argument('--spike-weight', type=float, default=1.0)
+    parser.add_argument('--out', default=None, help='write the best parameters to this json file')
+    args = parser.parse_args(argv)
+
+    import scipy.io
+    target = scipy.io.loadmat(args.target)[args.cell].ravel()
+    g = batch.load_conductances(args.conductances)
+    # same pairing as HybridCell_ContrastResp.py
+    if args.cell == 'OFFsA':
+        base, exc, inh = batch.OFFsA_PARAMS, g['bSbC_Exc'], g['bSbC_Inh']
+    else:
+        base, exc, inh = batch.bSbC_PARAMS, g['Alpha_Exc'], g['Alpha_Inh']
+
+    best, res, cmap = fit(base, exc, inh, target, workers=args.workers, popsize=args.popsize,
+                          maxiter=args.maxiter, decimals=args.decimals, cache_file=args.cache,
+                          spike_weight=args.spike_weight)
+    print('best cost %.4f after %d generations' % (res.fun, res.nit))
+    print('cache: %d hits, %d simulations' % (cmap.hits, cmap.misses))
+    print(best)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(best, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
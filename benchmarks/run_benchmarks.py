@@ -0,0 +1,237 @@
+"""
+Performance regression benchmarks for the simulators in this repo.
+
+Each benchmark is a fixed, small but representative workload:
+
+    hh_step           HH/HH_model.euler on the protocol of HH/HH.py (1 s, dt 1 us, 30 pA
+                      smoothed step at T/3 lasting 300 ms)
+    pump_dyndyn       Pump/pump_model DynDyn 25 s step protocol plus feature extraction
+    hybridcell_build  HybridCell(OFFsA parameters) constructed 1000 times
+    contrast_response HybridCell dynamic clamp, 2.5 s of synthetic conductances
+                      (seeded, low-pass filtered noise instead of the Z: drive files)
+    cone_sine_square  Photorreceptors/cone_model.solve, sine + square stimuli
+    neuron_ap         NEURON/action_potential.py (plotting disabled)
+
+Every benchmark runs in a fresh subprocess, so NEURON state and peak RSS are not
+shared between them. For each one the wall time (best of --repeat runs inside the
+subprocess), the peak RSS of the subprocess and the simulation steps per second
+are recorded. Benchmarks whose dependencies are missing (e.g. no NEURON) are
+recorded as skipped.
+
+usage:
+    python benchmarks/run_benchmarks.py [--out results.json] [--only hh_step pump_dyndyn]
+    python benchmarks/run_benchmarks.py --save-baseline        # writes benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json [--threshold 0.2]
+
+With --baseline, benchmarks slower than the baseline by more than --threshold
+(relative wall time) or using more than --rss-threshold more peak memory are
+flagged and the exit status is 1. benchmarks/baseline.json is the committed
+reference; its meta block records the commit and machine it was measured on, so
+compare against it on similar hardware or save a local one first.
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import contextlib
+import subprocess
+
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(REPO, 'benchmarks', 'baseline.json')
+HYBRID_DIR = os.path.join(REPO, 'bSbC_ModelFiles-WienbarSchwartz')
+
+
+# =============================================================================
+# Workloads: each returns the number of simulation steps (or constructions)
+# =============================================================================
+def hh_step():
+    sys.path.insert(0, os.path.join(REPO, 'HH'))
+    import HH_model
+    T, dt = 1000, .001 # as in HH.py
+    time_ = np.arange(0, T, dt)
+    Ix = HH_model.smooth_step(time_, StepStrength=30, StepTime=T/3, StepDuration=300)
+    HH_model.euler(Ix, dt)
+    return len(time_)
+
+
+def pump_dyndyn():
+    sys.path.insert(0, os.path.join(REPO, 'Pump'))
+    import pump_model
+    model = pump_model.PumpModel() # DynDyn defaults
+    t, y, _ = model.simulate(pump_model.step_protocol(50.0, tHold=5000, tPulse=5000, tPost=15000))
+    model.features(t, y, 5000, 5000)
+    return len(t)
+
+
+def hybridcell_build():
+    sys.path.insert(0, HYBRID_DIR)
+    from HybridCell_Batch import HybridCell, OFFsA_PARAMS
+    with contextlib.redirect_stdout(io.StringIO()): # HybridCell prints v_init
+        for _ in range(1000):
+            HybridCell(**OFFsA_PARAMS)
+    return 1000
+
+
+def contrast_response():
+    sys.path.insert(0, HYBRID_DIR)
+    from scipy.signal import lfilter
+    from neuron import h
+    import HybridCell_Batch as batch
+    rng = np.random.default_rng(0)
+    n = int(batch.TSTOP / batch.DT) + 1
+    def synthetic(mean, sd):
+        # conductance (nS) with ~20 ms correlations, like the recorded drive
+        x = lfilter([0.005], [1, -0.995], rng.standard_normal(n)) / np.sqrt(0.005 / 1.995)
+        return np.maximum(mean + sd * x, 0.1)
+    h.celsius = batch.temp
+    h.dt = batch.DT
+    with contextlib.redirect_stdout(io.StringIO()):
+        cell = batch.HybridCell(**batch.OFFsA_PARAMS)
+    batch.attach_dynamic_clamp(cell, batch.conductance_to_rs(synthetic(4.0, 2.0)),
+                               batch.conductance_to_rs(synthetic(6.0, 2.0)))
+    batch.run(batch.TSTOP)
+    return int(round(h.t / h.dt))
+
+
+def cone_sine_square():
+    sys.path.insert(0, os.path.join(REPO, 'Photorreceptors'))
+    import cone_model
+    dt = 1e-4
+    t = np.arange(0, 4, dt)
+    stimuli = np.array([cone_model.sinewave(0.5, 3.5, 0, f, 2000)(t) + 2500 for f in (1, 2, 4, 8)] +
+                       [cone_model.square(0.5, 3.5, A)(t) for A in (500, 2000, 5000, 20000)])
+    cone_model.solve(stimuli, dt)
+    return stimuli.size
+
+
+def neuron_ap():
+    import runpy
+    import matplotlib
+    matplotlib.use('Agg')
+    from neuron import h
+    runpy.run_path(os.path.join(REPO, 'NEURON', 'action_potential.py'), run_name='__main__')
+    return int(round(h.t / h.dt))
+
+
+BENCHMARKS = dict(hh_step=hh_step, pump_dyndyn=pump_dyndyn, hybridcell_build=hybridcell_build,
+                  contrast_response=contrast_response, cone_sine_square=cone_sine_square, neuron_ap=neuron_ap)
+
+
+# =============================================================================
+# Runner
+# =============================================================================
+def _child(name, repeat):
+    # runs inside the subprocess, prints one JSON object
+    walls = []
+    try:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            steps = BENCHMARKS[name]()
+            walls.append(time.perf_counter() - t0)
+    except ImportError as e:
+        print(json.dumps(dict(skipped='missing dependency: %s' % e)))
+        return
+    wall = min(walls)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # kB on Linux
+    print(json.dumps(dict(wall=wall, peak_rss_mb=peak_kb / 1024, steps=steps, steps_per_s=steps / wall,
+                          repeats=len(walls))))
+
+
+def run(names, repeat=1):
+    results = {}
+    for name in names:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, '--repeat', str(repeat)],
+                              capture_output=True, text=True, cwd=REPO)
+        try:
+            results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            results[name] = dict(error=proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'no output')
+        print('%-18s %s' % (name, _summary(results[name])), file=sys.stderr)
+    return results
+
+
+def _summary(r):
+    if 'wall' not in r:
+        return r.get('skipped') or 'ERROR: %s' % r.get('error')
+    return '%8.3f s  %7.1f MB  %12.0f steps/s' % (r['wall'], r['peak_rss_mb'], r['steps_per_s'])
+
+
+def _meta():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=REPO).stdout.strip()
+    except OSError:
+        commit = ''
+    return dict(commit=commit, python=platform.python_version(), numpy=np.__version__,
+                machine=platform.machine(), node=platform.node(), date=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def compare(results, baseline, threshold=0.2, rss_threshold=0.5, names=None):
+    """
+    Regressions of results against baseline (both {name: result}) over names
+    (default: every benchmark in either): a list of (name, metric, baseline
+    value, new value, relative change) beyond the thresholds. A benchmark the
+    baseline has a measurement for but that now has none (it failed, was skipped
+    or is missing from results) is flagged as (name, 'error', baseline wall
+    time, reason, None).
+    """
+    flagged = []
+    for name in names if names is not None else sorted(set(results) | set(baseline)):
+        r, b = results.get(name, dict(error='missing from the results')), baseline.get(name, {})
+        if 'wall' not in b:
+            continue
+        if 'wall' not in r:
+            flagged.append((name, 'error', b['wall'], r.get('skipped') or r.get('error'), None))
+            continue
+        for metric, limit in (('wall', threshold), ('peak_rss_mb', rss_threshold)):
+            change = r[metric] / b[metric] - 1
+            if change > limit:
+                flagged.append((name, metric, b[metric], r[metric], change))
+    return flagged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='simulator performance benchmarks')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='run only these benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the fastest is kept')
+    parser.add_argument('--out', default=None, help='write the results JSON here')
+    parser.add_argument('--baseline', default=None, help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to %s' % BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative wall time increase')
+    parser.add_argument('--rss-threshold', type=float, default=0.5, help='allowed relative peak RSS increase')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _child(args.child, args.repeat)
+        return 0
+
+    doc = dict(meta=_meta(), results=run(args.only or list(BENCHMARKS), args.repeat))
+    for path in filter(None, [args.out, BASELINE if args.save_baseline else None]):
+        with open(path, 'w') as f:
+            json.dump(doc, f, indent=1)
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    flagged = compare(doc['results'], baseline['results'], args.threshold, args.rss_threshold,
+                      args.only or list(BENCHMARKS))
+    for name, metric, old, new, change in flagged:
+        if metric == 'error':
+            print('REGRESSION %s: %.3f s in the baseline, now %s' % (name, old, new))
+        else:
+            print('REGRESSION %s %s: %.3f -> %.3f (%+.0f%%)' % (name, metric, old, new, 100 * change))
+    if not flagged:
+        print('no regressions against %s (commit %s)' % (args.baseline, baseline['meta'].get('commit')))
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
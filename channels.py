@@ -0,0 +1,364 @@
+"""
+Declarative ion-channel kinetics, compiled to vectorized NumPy right-hand sides.
+
+The HH model (HH/HH_model.py: alphan ... betah), the pump model
+(Pump/pump_model.py: minf_NaT, htau_Kf, ninf_Ks, ...) and the NEURON mechanisms
+(na12.mod, na16.mod, kv.mod) are all built from the same pieces: Boltzmann and
+exponential rates, linoid rates (trap0 in the .mod files), Q10 temperature
+scaling (tadj) and gates raised to a power. Here a channel is written down once as
+data, and build() turns a list of channels into generated Python source for
+
+    rhs(y, t=0.0, I=0.0, **reversals)       dy/dt
+    jacobian(y, t=0.0, I=0.0, **reversals)  d(dy/dt)/dy
+    currents(y, **reversals)                 dict channel name -> current
+    steady_state(V)                          y with every gate at its steady state
+
+Every distinct rate expression (e.g. the exp() shared by a gate's alpha and its
+derivative, or the same Boltzmann used by two channels) is computed once per
+call. y is either one state vector (n_states,) -- usable directly with odeint --
+or a batch (n_states, N) of N cells, evaluated in one set of array operations.
+State 0 is V; the gates follow in channel order, named '<channel>_<gate>'.
+
+The library is unit-agnostic: use mS/cm2, uA/cm2, uF/cm2 (HH) or nS, pA, pF
+(pump) consistently. A channel's reversal potential is a number, or the name of a
+keyword argument of the generated functions (e.g. 'ENa' for the pump model's
+dynamic sodium reversal). Ion concentrations and pumps are not channels; models
+that need them (pump_model.py) add those terms around the generated RHS.
+
+example: the HH cell with an added persistent sodium current
+    model = build(HH_CHANNELS + [Channel('NaP', 0.5, 50.0, [Gate('m', inf=Boltzmann(-48.77, -3.68), tau=Const(1.0))])])
+    y = odeint(model.rhs, model.steady_state(-65.0), t, args=(10.0,))
+"""
+from collections import namedtuple
+
+import numpy as np
+
+
+# =============================================================================
+# Rate expressions
+# =============================================================================
+# Each emits code for its value (and optionally its derivative in V) into a
+# _Code block and returns the names of the variables holding them.
+
+def _lin(v, vhalf, k):
+    # '(V - vhalf) / k' as one add and one multiply
+    return '(%s + %r) * %r' % (v, -float(vhalf), 1 / float(k))
+
+
+def _affine(c, A, term):
+    # 'c + A * term' without the no-op parts
+    s = term if A == 1 else '%r * %s' % (float(A), term)
+    return s if c == 0 else '%r + %s' % (float(c), s)
+
+
+class Const(namedtuple('Const', 'c')):
+    """ c """
+    def emit(self, code, v, deriv):
+        return repr(float(self.c)), ('0.0' if deriv else None)
+
+
+class Exp(namedtuple('Exp', 'A vhalf k c', defaults=(0.0,))):
+    """ c + A * exp((V - vhalf) / k) """
+    def emit(self, code, v, deriv):
+        e = code.let('exp(%s)' % _lin(v, self.vhalf, self.k))
+        val = code.let(_affine(self.c, self.A, e))
+        return val, (code.let('%r * %s' % (self.A / self.k, e)) if deriv else None)
+
+
+class Boltzmann(namedtuple('Boltzmann', 'vhalf k A c', defaults=(1.0, 0.0))):
+    """ c + A / (1 + exp((V - vhalf) / k)) """
+    def emit(self, code, v, deriv):
+        e = code.let('exp(%s)' % _lin(v, self.vhalf, self.k))
+        val = code.let(_affine(self.c, self.A, '(1 / (1 + %s))' % e))
+        return val, (code.let('%r * %s / (1 + %s)**2' % (-self.A / self.k, e, e)) if deriv else None)
+
+
+class Trap0(namedtuple('Trap0', 'A th k')):
+    """
+    A * (V - th) / (1 - exp(-(V - th) / k)), the linoid rate (trap0 of the .mod
+    files). With u = (V - th) / k it is A k u / (1 - exp(-u)), evaluated with
+    expm1 and, for |u| < 1e-3, as its series A k (1 + u/2 + u^2/12), which is
+    the limit A k of trap0 at V = th (and its derivative A (1/2 + u/6)).
+    """
+    def emit(self, code, v, deriv):
+        u = code.let('(%s + %r) * %r' % (v, -float(self.th), 1 / float(self.k)))
+        small = code.let('absolute(%s) < 1e-3' % u)
+        em = code.let('expm1(-%s)' % u) # exp(-u) - 1, exact for small u
+        den = code.let('where(%s, -1.0, %s)' % (small, em)) # no 0/0 in the unused branch
+        val = code.let('%r * where(%s, 1 + %s * (0.5 + %s / 12), %s / -%s)'
+                       % (float(self.A) * float(self.k), small, u, u, u, den))
+        if not deriv:
+            return val, None
+        # A * (1 - (1 + u) exp(-u)) / (1 - exp(-u))**2 cancels for small u: use its series
+        return val, code.let('%r * where(%s, 0.5 + %s / 6, (-%s - %s * (1 + %s)) / %s**2)'
+                             % (float(self.A), small, u, em, u, em, den))
+
+
+class InvSum(namedtuple('InvSum', 'a b')):
+    """ 1 / (a + b), e.g. a time constant from two rates """
+    def emit(self, code, v, deriv):
+        a, da = self.a.emit(code, v, deriv)
+        b, db = self.b.emit(code, v, deriv)
+        val = code.let('1 / (%s + %s)' % (a, b))
+        return val, (code.let('-(%s + %s) * %s**2' % (da, db, val)) if deriv else None)
+
+
+# =============================================================================
+# Channels
+# =============================================================================
+class Gate(namedtuple('Gate', 'name power alpha beta inf tau mix weight',
+                      defaults=(1, None, None, None, None, None, 1.0))):
+    """
+    A gating variable with either opening/closing rates (alpha, beta) or a
+    steady state and time constant (inf, tau). It enters the conductance as
+    gate**power. Gates of a channel with the same mix key are summed with their
+    weights first (e.g. fast K inactivation 0.95*h1 + 0.05*h2), and the sum is
+    raised to the power of the first of them.
+    """
+
+
+class Channel(namedtuple('Channel', 'name g E gates q10 temp vshift gtadj', defaults=((), None, None, 0.0, False))):
+    """
+    I = g * prod(gates) * (V - E). E is a number or the name of a keyword argument.
+    With q10 and temp (degC) the rates are scaled by tadj = q10**((celsius - temp)/10),
+    and with gtadj=True the conductance as well (gna = tadj*gbar*m^3*h in na12.mod);
+    vshift shifts the voltage seen by all the rates (V + vshift), as in na12.mod.
+    """
+
+
+class _Code:
+    # straight-line code with common subexpression elimination by expression text
+    def __init__(self):
+        self.lines, self.names = [], {}
+
+    def let(self, expr):
+        if expr not in self.names:
+            self.names[expr] = '_t%d' % len(self.names)
+            self.lines.append('    %s = %s' % (self.names[expr], expr))
+        return self.names[expr]
+
+
+class Kinetics:
+    """
+    Compiled channel set returned by build(). Attributes: channels, states (names),
+    reversals (keyword arguments with their defaults), Cm, source (the generated
+    code) and the generated functions rhs, jacobian, currents, steady_state.
+    """
+    def __init__(self, channels, Cm, celsius, reversals):
+        self.channels, self.Cm, self.celsius = list(channels), Cm, celsius
+        self.reversals = dict(reversals)
+        self.states = ['V'] + ['%s_%s' % (c.name, g.name) for c in self.channels for g in c.gates]
+        for c in self.channels:
+            if isinstance(c.E, str) and c.E not in self.reversals:
+                raise ValueError('channel %s: no default given for reversal %r' % (c.name, c.E))
+        self.source = '\n\n'.join([self._rhs(), self._jacobian(), self._currents(), self._steady_state()])
+        namespace = dict(np=np, exp=np.exp, expm1=np.expm1, where=np.where, absolute=np.absolute)
+        exec(compile(self.source, '<channels %s>' % ', '.join(c.name for c in self.channels), 'exec'), namespace)
+        self.rhs, self.jacobian = namespace['rhs'], namespace['jacobian']
+        self.currents, self.steady_state = namespace['currents'], namespace['steady_state']
+
+    def index(self, name):
+        return self.states.index(name)
+
+    def __len__(self):
+        return len(self.states)
+
+    # ---- code generation ----
+    def _tadj(self, c):
+        if c.q10 is None or self.celsius is None:
+            return 1.0
+        return c.q10 ** ((self.celsius - c.temp) / 10)
+
+    def _per_Cm(self, expr):
+        return expr if self.Cm == 1 else '(%s) * %r' % (expr, 1 / float(self.Cm))
+
+    def _signature(self, head):
+        kw = ''.join(', %s=%r' % kv for kv in self.reversals.items())
+        return 'def %s%s):' % (head, kw)
+
+    def _unpack(self, code):
+        code.lines.append('    y = np.asarray(y, dtype=float)')
+        code.lines.append('    %s, = y' % ', '.join('y_%d' % i for i in range(len(self.states))))
+
+    def _gate_terms(self, code, deriv):
+        # per state (index >= 1): (dx/dt, d/dV, d/dx) expressions
+        terms, i = {}, 1
+        for c in self.channels:
+            tadj = self._tadj(c)
+            v = 'y_0' if not c.vshift else code.let('y_0 + %r' % float(c.vshift))
+            scale = (lambda e: e) if tadj == 1 else (lambda e, k=repr(tadj): '%s * (%s)' % (k, e))
+            for g in c.gates:
+                x = 'y_%d' % i
+                ddV = ddx = None
+                if g.alpha is not None:
+                    a, da = g.alpha.emit(code, v, deriv)
+                    b, db = g.beta.emit(code, v, deriv)
+                    dx = scale('%s * (1 - %s) - %s * %s' % (a, x, b, x))
+                    if deriv:
+                        ddV = scale('%s * (1 - %s) - %s * %s' % (da, x, db, x))
+                        ddx = scale('-(%s + %s)' % (a, b))
+                else:
+                    inf, dinf = g.inf.emit(code, v, deriv)
+                    tau, dtau = g.tau.emit(code, v, deriv)
+                    dx = scale('(%s - %s) / %s' % (inf, x, tau))
+                    if deriv:
+                        ddV = scale('%s / %s - (%s - %s) * %s / %s**2' % (dinf, tau, inf, x, dtau, tau))
+                        ddx = scale('-1 / %s' % tau)
+                terms[i] = (dx, ddV, ddx)
+                i += 1
+        return terms
+
+    def _conductances(self, code):
+        # per channel: (conductance expression, {state index: d conductance / d state}, E)
+        out, i = [], 1
+        for c in self.channels:
+            gbar = repr(float(c.g * self._tadj(c) if c.gtadj else c.g))
+            groups = {} # mix key -> [power, [(weight, state var)]]
+            for g in c.gates:
+                key = g.name if g.mix is None else g.mix
+                groups.setdefault(key, [g.power, []])[1].append((g.weight, i))
+                i += 1
+            factors = [] # (value var, power, [(weight, index)])
+            for power, members in groups.values():
+                s = ' + '.join('%r * y_%d' % (float(w), j) if w != 1 else 'y_%d' % j for w, j in members)
+                factors.append((code.let(s) if ' ' in s else s, power, members))
+            gexpr = ' * '.join([gbar] + ['%s**%d' % (f, p) if p != 1 else f for f, p, _ in factors])
+            grads = {}
+            for k, (f, p, members) in enumerate(factors):
+                rest = [gbar] + ['%s**%d' % (f2, p2) if p2 != 1 else f2
+                                             for m, (f2, p2, _) in enumerate(factors) if m != k]
+                dfac = ' * '.join(rest + ([('%d * %s**%d' % (p, f, p - 1)) if p > 2 else
+                                           ('2 * %s' % f if p == 2 else '1.0')]))
+                for w, j in members:
+                    grads[j] = dfac if w == 1 else '%r * %s' % (float(w), dfac)
+            E = c.E if isinstance(c.E, str) else repr(float(c.E))
+            out.append((gexpr, grads, E))
+        return out
+
+    def _rhs(self):
+        code = _Code()
+        self._unpack(code)
+        terms = self._gate_terms(code, False)
+        I_ion = ' + '.join('%s * (y_0 - %s)' % (gexpr, E) for gexpr, _, E in self._conductances(code)) or '0.0'
+        body = ['    if callable(I):', '        I = I(t)', '    out = np.empty(y.shape)',
+                '    out[0] = %s' % self._per_Cm('I - (%s)' % I_ion)]
+        body += ['    out[%d] = %s' % (i, t[0]) for i, t in terms.items()]
+        return '\n'.join([self._signature('rhs(y, t=0.0, I=0.0')] + code.lines + body + ['    return out'])
+
+    def _jacobian(self):
+        code = _Code()
+        self._unpack(code)
+        terms = self._gate_terms(code, True)
+        cond = self._conductances(code)
+        n = len(self.states)
+        body = ['    J = np.zeros((%d, %d) + y.shape[1:])' % (n, n),
+                '    J[0, 0] = -(%s) / %r' % (' + '.join(g for g, _, _ in cond) or '0.0', float(self.Cm))]
+        for j in range(1, n):
+            parts = ['%s * (y_0 - %s)' % (grads[j], E) for _, grads, E in cond if j in grads]
+            body.append('    J[0, %d] = -(%s) / %r' % (j, ' + '.join(parts), float(self.Cm)))
+        for i, (_, ddV, ddx) in terms.items():
+            body += ['    J[%d, 0] = %s' % (i, ddV), '    J[%d, %d] = %s' % (i, i, ddx)]
+        return '\n'.join([self._signature('jacobian(y, t=0.0, I=0.0')] + code.lines + body + ['    return J'])
+
+    def _currents(self):
+        code = _Code()
+        self._unpack(code)
+        items = ['%r: %s * (y_0 - %s)' % (c.name, gexpr, E) for c, (gexpr, _, E) in zip(self.channels, self._conductances(code))]
+        return '\n'.join([self._signature('currents(y')] + code.lines + ['    return {%s}' % ', '.join(items)])
+
+    def _steady_state(self):
+        code = _Code()
+        code.lines.append('    y_0 = np.asarray(V, dtype=float)')
+        values = []
+        for c in self.channels:
+            v = 'y_0' if not c.vshift else code.let('y_0 + %r' % float(c.vshift))
+            for g in c.gates:
+                if g.alpha is not None:
+                    a, _ = g.alpha.emit(code, v, False)
+                    b, _ = g.beta.emit(code, v, False)
+                    values.append(code.let('%s / (%s + %s)' % (a, a, b)))
+                else:
+                    values.append(g.inf.emit(code, v, False)[0])
+        body = '    return np.array(np.broadcast_arrays(%s))' % ', '.join(['y_0'] + values)
+        return '\n'.join(['def steady_state(V):'] + code.lines + [body])
+
+
+def build(channels, Cm=1.0, celsius=None, reversals=None):
+    """
+    Compile channels into a Kinetics object.
+
+    Parameters:
+        channels  : list of Channel.
+        Cm        : membrane capacitance.
+        celsius   : temperature for the Q10 scaling of channels with q10/temp
+                    (None: no scaling).
+        reversals : defaults of the named reversal potentials, e.g. {'ENa': 50.0}.
+    """
+    return Kinetics(channels, Cm, celsius, reversals or {})
+
+
+# =============================================================================
+# Channel Library
+# =============================================================================
+# Hodgkin-Huxley squid axon, as in HH/HH.py (mS/cm2, mV, uF/cm2)
+HH_CHANNELS = [
+    Channel('Na', 120.0, 50.0, [Gate('m', 3, alpha=Trap0(.1, -40.0, 10.0), beta=Exp(4.0, -65.0, -1/.0556)),
+                                Gate('h', 1, alpha=Exp(.07, -65.0, -20.0), beta=Boltzmann(-35.0, -10.0))]),
+    Channel('K', 36.0, -77.0, [Gate('n', 4, alpha=Trap0(.01, -55.0, 10.0), beta=Exp(.125, -65.0, -80.0))]),
+    Channel('L', .3, -54.387),
+]
+
+
+def pump_channels(g_NaT=100.0, g_NaP=0.8, g_Ks=50.0, g_Kf=15.1, g_leak_Na=1.2, g_leak_K=3.75, E_K=-80.0):
+    """
+    Membrane channels of the fly motor neuron in Pump/pump_model.py (nS, mV). The
+    sodium channels use the named reversal 'ENa'.
+    """
+    return [
+        Channel('NaT', g_NaT, 'ENa', [Gate('m', 3, inf=Boltzmann(-29.13, -8.922), tau=Boltzmann(-51.35, -5.98, -3.434, 3.861)),
+                                      Gate('h', 1, inf=Boltzmann(-40.0, 6.048), tau=Boltzmann(-21.9, -2.641, -2.371, 2.834))]),
+        Channel('NaP', g_NaP, 'ENa', [Gate('m', 1, inf=Boltzmann(-48.77, -3.68), tau=Const(1.0))]),
+        Channel('Ks', g_Ks, E_K, [Gate('n', 4, inf=Boltzmann(-12.85, -19.91), tau=Boltzmann(29.83, 3.32, 1.96, 2.03))]),
+        Channel('Kf', g_Kf, E_K, [Gate('m', 4, inf=Boltzmann(-17.55, -7.27), tau=Boltzmann(8.12, 7.96, 2.66, 1.94)),
+                                  Gate('h1', 1, inf=Boltzmann(-45.0, 6.0), tau=Boltzmann(-147.4, 28.66, 515.8, 1.79), mix='h', weight=0.95),
+                                  Gate('h2', 1, inf=Boltzmann(-44.2, 1.5), tau=Const(116.0), mix='h', weight=0.05)]),
+        Channel('leak_Na', g_leak_Na, 'ENa'),
+        Channel('leak_K', g_leak_K, E_K),
+    ]
+
+
+def _mainen_na(name, gbar, E, vshift, tha, qa):
+    # na12.mod / na16.mod (Mainen 1994), which differ only in tha and qa
+    Ra, Rb = 0.182, 0.124
+    thi1, thi2, qi, thinf, qinf, Rg, Rd = -50.0, -75.0, 5.0, -72.0, 6.2, 0.0091, 0.024
+    m = Gate('m', 3, alpha=Trap0(Ra, tha, qa), beta=Trap0(-Rb, tha, -qa)) # trap0(-v,-th,Rb,q) = trap0 with -Rb, -q
+    h = Gate('h', 1, inf=Boltzmann(thinf, qinf), tau=InvSum(Trap0(Rd, thi1, qi), Trap0(-Rg, thi2, -qi)))
+    return Channel(name, gbar * 0.1, E, [m, h], q10=2.3, temp=23.0, vshift=vshift, gtadj=True)
+
+
+def na12(gbar=1000.0, E='ena', vshift=-5.0):
+    """
+    na12.mod (Mainen 1994) with its default parameters. gbar in pS/um2; the
+    conductance is returned in mS/cm2. The .mod file integrates this with
+    exponential Euler from tables; here it is the underlying ODE.
+    """
+    return _mainen_na('na12', gbar, E, vshift, tha=-43.0, qa=7.0)
+
+
+def na16(gbar=1000.0, E='ena', vshift=-5.0):
+    """
+    na16.mod, the HybridCell sodium channel: na12 with a steeper, 1 mV more
+    depolarised activation (tha = -42, qa = 6). Units as in na12().
+    """
+    return _mainen_na('na16', gbar, E, vshift, tha=-42.0, qa=6.0)
+
+
+def kv(gbar=5.0, E='ek'):
+    """
+    kv.mod, the HybridCell delayed rectifier: one gate n with linoid rates
+    around tha = 25 mV, gk = tadj * gbar * n. gbar in pS/um2, conductance in
+    mS/cm2.
+    """
+    tha, qa, Ra, Rb = 25.0, 9.0, 0.02, 0.002
+    n = Gate('n', 1, alpha=Trap0(Ra, tha, qa), beta=Trap0(-Rb, tha, -qa))
+    return Channel('kv', gbar * 0.1, E, [n], q10=2.3, temp=23.0, gtadj=True)
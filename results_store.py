@@ -0,0 +1,439 @@
+"""
+Columnar store of sweep results (scalar features per run, indexed by parameter
+columns) with the traces of each run in side files, for the pump sweeps
+(Pump/HH_pump_Megwa.PY) and the HybridCell batch runs
+(bSbC_ModelFiles-WienbarSchwartz/HybridCell_Batch.py).
+
+Layout of a store directory:
+
+    schema.json                  index columns and the kind of every column
+    segments/seg-*.npz           immutable column chunks (one array per column)
+    traces/ab/abcdef....npz      traces of run 'abcdef...' (optional)
+
+Every row gets a unique 'run_id'. append() writes a new segment atomically (temp
+file + rename) and never touches existing ones, so any number of workers can
+append to the same directory. They only take a lock (schema.lock, an O_EXCL lock
+file naming its owner's host and pid; broken when that process is gone, or after
+an hour if it is on another host) to add a column to schema.json or widen its
+kind: int and bool columns widen to float when a float value arrives, and rows
+without a numeric column read as nan, so no sentinel can be mistaken for a value. Each segment also holds
+the min/max of its index columns, so queries skip segments that cannot match and
+only read the columns they need. Segments are cached in memory once read (they
+never change). After a sweep, compact() merges all segments into one sorted by
+the index, which makes later queries a binary search plus a mask.
+
+Filters: a scalar selects equal values, a tuple (lo, hi) an inclusive range
+(None for an open end) and a list a set of values.
+
+example:
+    store = ResultsStore('sweeps/pump', index=['Imaxpump', 'naih', 'nais', 'I_pulse'])
+    store.append(dict(Imaxpump=75, naih=.01, nais=.01, I_pulse=50, **feats), traces=dict(t=t, V=V))
+    rows = store.query(['naih', 'mean_ifr'], naih=(0.005, 0.02), Imaxpump=75)
+    V = store.traces(rows['run_id'][0])['V']
+"""
+import os
+import json
+import time
+import socket
+import uuid
+import tempfile
+
+import numpy as np
+
+
+def _kind(a):
+    # column kind stored in the schema
+    if a.dtype.kind in 'US':
+        return 'str'
+    if a.dtype.kind == 'b':
+        return 'bool'
+    if a.dtype.kind in 'iu':
+        return 'int'
+    if a.dtype.kind == 'f':
+        return 'float'
+    raise TypeError('unsupported column dtype %s' % a.dtype)
+
+
+_DTYPES = dict(str=str, bool=bool, int=np.int64, float=np.float64)
+_NUMERIC = ('bool', 'int', 'float') # in widening order
+
+
+def _merge_kind(old, new):
+    # kind of a column holding values of both kinds
+    if old is None or old == new:
+        return new
+    if old in _NUMERIC and new in _NUMERIC:
+        return _NUMERIC[max(_NUMERIC.index(old), _NUMERIC.index(new))]
+    raise TypeError('column of kind %s cannot hold %s values' % (old, new))
+
+
+def _to_array(values, kind):
+    # column array of a segment; None marks rows without the column, numeric
+    # columns with gaps are stored as float with nan
+    if kind == 'str':
+        return np.array(['' if v is None else v for v in values], dtype=str)
+    if any(v is None for v in values):
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    return np.array(values, dtype=_DTYPES[kind])
+
+
+def _lock(path, wait=True, timeout=60.0, max_age=3600.0):
+    # take an O_EXCL lock file holding 'host pid time token' of its owner; False
+    # if it is held and wait is False. Stale locks are broken: on this host when
+    # the owner process is gone, from other hosts when older than max_age s
+    t0 = time.monotonic()
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            owner = _lock_owner(path)
+            if owner is None: # released meanwhile
+                continue
+            if _stale(path, owner, max_age):
+                _break_lock(path, owner)
+                continue
+            if not wait:
+                return False
+            if time.monotonic() - t0 > timeout:
+                raise TimeoutError('%s held by %r for more than %g s' % (path, owner, timeout))
+            time.sleep(0.01)
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write('%s %d %r %s' % (_HOST, os.getpid(), time.time(), uuid.uuid4().hex))
+            return True
+
+
+_HOST = socket.gethostname().replace(' ', '_')
+
+
+def _lock_owner(path):
+    # contents of a lock file, None if it no longer exists
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _stale(path, owner, max_age):
+    try:
+        host, pid, t, _ = owner.split()
+        pid, t = int(pid), float(t)
+    except ValueError: # still being written (or not ours): go by the file age
+        try:
+            return time.time() - os.path.getmtime(path) > max_age
+        except OSError:
+            return False
+    if host == _HOST and os.name == 'posix':
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError: # alive, another user's
+            pass
+        return False
+    return time.time() - t > max_age
+
+
+def _break_lock(path, owner):
+    # remove a stale lock, unless it was replaced by a fresh one meanwhile
+    tmp = '%s.%s' % (path, uuid.uuid4().hex)
+    try:
+        os.rename(path, tmp)
+    except FileNotFoundError:
+        return
+    with open(tmp) as f:
+        taken = f.read()
+    if taken != owner: # someone else's fresh lock: put it back
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+    os.remove(tmp)
+
+
+def _atomic_save(path, arrays):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def _match(a, cond):
+    # boolean mask of the values of a that satisfy a filter
+    if isinstance(cond, tuple):
+        lo, hi = cond
+        mask = np.ones(len(a), dtype=bool)
+        if lo is not None:
+            mask &= a >= lo
+        if hi is not None:
+            mask &= a <= hi
+        return mask
+    if isinstance(cond, (list, set, frozenset, np.ndarray)):
+        return np.isin(a, list(cond))
+    return a == cond
+
+
+def _overlaps(lo, hi, cond):
+    # can a segment whose column lies in [lo, hi] contain values matching cond?
+    if np.isnan(lo) or isinstance(cond, str):
+        return True
+    if isinstance(cond, tuple):
+        return (cond[0] is None or hi >= cond[0]) and (cond[1] is None or lo <= cond[1])
+    if isinstance(cond, (list, set, frozenset, np.ndarray)):
+        return any(lo <= c <= hi for c in cond)
+    return lo <= cond <= hi
+
+
+class ResultsStore:
+    def __init__(self, directory, index=(), flush_every=1):
+        """
+        Parameters:
+            directory   : store directory (created if missing).
+            index       : parameter columns to index; taken from schema.json if the
+                          store already exists.
+            flush_every : rows buffered by append() before a segment is written;
+                          flush() (or leaving a `with store:` block) writes the rest.
+        """
+        self.directory = os.path.expanduser(directory)
+        self.flush_every = flush_every
+        self._schema_path = os.path.join(self.directory, 'schema.json')
+        self._segment_dir = os.path.join(self.directory, 'segments')
+        self._trace_dir = os.path.join(self.directory, 'traces')
+        os.makedirs(self._segment_dir, exist_ok=True)
+        self.schema = self._read_schema()
+        if self.schema is None:
+            self.schema = dict(index=list(index), columns={})
+        elif index and list(index) != self.schema['index']:
+            raise ValueError('store %s is indexed by %s' % (self.directory, self.schema['index']))
+        self.index = self.schema['index']
+        self._buffer = []
+        self._cache = {} # segment name -> {column: array}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    # -------------------------------------------------------------------------
+    # schema
+    # -------------------------------------------------------------------------
+    def _read_schema(self):
+        try:
+            with open(self._schema_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _update_schema(self, columns):
+        # add new columns (name -> kind) and widen existing ones, merged into the
+        # schema on disk under schema.lock so concurrent writers lose nothing
+        known = self.schema['columns']
+        if all(_merge_kind(known.get(k), v) == known.get(k) for k, v in columns.items()):
+            return
+        lock = os.path.join(self.directory, 'schema.lock')
+        _lock(lock)
+        try:
+            current = self._read_schema() or dict(index=self.index, columns={})
+            for k, v in columns.items():
+                current['columns'][k] = _merge_kind(current['columns'].get(k), v)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(current, f, indent=1)
+            os.replace(tmp, self._schema_path)
+        finally:
+            os.remove(lock)
+        self.schema = current
+
+    # -------------------------------------------------------------------------
+    # writing
+    # -------------------------------------------------------------------------
+    def append(self, rows, traces=None):
+        """
+        Add runs. rows is one row (dict of scalars), a list of rows, or columns
+        (dict of equal-length arrays). traces is a dict of arrays for one row, or
+        a list with one dict (or None) per row. Returns the new run ids.
+        """
+        if isinstance(rows, dict) and all(np.ndim(v) == 0 for v in rows.values()):
+            rows, traces = [rows], [traces]
+        if isinstance(rows, dict):
+            n = len(next(iter(rows.values())))
+            rows = [{k: v[i] for k, v in rows.items()} for i in range(n)]
+        if traces is None:
+            traces = [None]*len(rows)
+        if len(traces) != len(rows):
+            raise ValueError('%d rows but %d traces' % (len(rows), len(traces)))
+        missing = [k for k in self.index if any(k not in r for r in rows)]
+        if missing:
+            raise ValueError('rows lack index columns %s' % missing)
+
+        ids = []
+        for row, tr in zip(rows, traces):
+            run_id = uuid.uuid4().hex
+            if tr is not None: # traces first, so a visible row always has them
+                _atomic_save(self._trace_path(run_id), tr)
+            self._buffer.append(dict(row, run_id=run_id))
+            ids.append(run_id)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+        return ids
+
+    def flush(self):
+        """
+        Write the buffered rows as one segment.
+        """
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        names = list(dict.fromkeys(k for r in rows for k in r))
+        self._update_schema({k: _kind(np.asarray([r[k] for r in rows if k in r])) for k in names})
+        kinds = self.schema['columns']
+        columns = {k: _to_array([r.get(k) for r in rows], kinds[k]) for k in names}
+        self._write_segment(columns)
+
+    def _write_segment(self, columns, replaces=(), sorted_=False):
+        n = len(columns['run_id'])
+        # zone map of the numeric index columns (nan: unknown, never skipped)
+        index = [columns.get(k, np.full(n, np.nan)) for k in self.index]
+        zone = [(np.nanmin(c.astype(float)), np.nanmax(c.astype(float))) if c.dtype.kind in 'biuf' and n
+                else (np.nan, np.nan) for c in index]
+        columns['__min__'] = np.array([z[0] for z in zone], dtype=float)
+        columns['__max__'] = np.array([z[1] for z in zone], dtype=float)
+        columns['__replaces__'] = np.array(list(replaces), dtype=str)
+        columns['__sorted__'] = np.array(sorted_)
+        name = 'seg-%d-%d-%s.npz' % (time.time_ns(), os.getpid(), uuid.uuid4().hex[:8])
+        _atomic_save(os.path.join(self._segment_dir, name), columns)
+        return name
+
+    def _trace_path(self, run_id):
+        return os.path.join(self._trace_dir, run_id[:2], run_id + '.npz')
+
+    # -------------------------------------------------------------------------
+    # reading
+    # -------------------------------------------------------------------------
+    def segments(self):
+        """
+        Names of the live segments (those not merged into a compacted segment).
+        """
+        names = sorted(f for f in os.listdir(self._segment_dir) if f.endswith('.npz'))
+        replaced = set()
+        for name in names:
+            replaced.update(self._column(name, '__replaces__'))
+        return [n for n in names if n not in replaced]
+
+    def _files(self, segment):
+        with np.load(os.path.join(self._segment_dir, segment)) as data:
+            return [k for k in data.files if not k.startswith('__')]
+
+    def _column(self, segment, column):
+        cached = self._cache.setdefault(segment, {})
+        if column not in cached:
+            with np.load(os.path.join(self._segment_dir, segment)) as data:
+                if column in data.files:
+                    cached[column] = data[column]
+                else: # column added after this segment was written
+                    n = len(data['run_id'])
+                    kind = self.schema['columns'].get(column, 'float')
+                    cached[column] = np.full(n, '' if kind == 'str' else np.nan, dtype=str if kind == 'str' else float)
+        a = cached[column]
+        if self.schema['columns'].get(column) == 'float' and a.dtype.kind in 'biu': # widened after writing
+            a = a.astype(float)
+        return a
+
+    def query(self, columns=None, **filters):
+        """
+        Rows matching all filters (column=value, (lo, hi) or [values]), as a dict
+        of arrays with the requested columns (default: all) plus run_id.
+        """
+        self.schema = self._read_schema() or self.schema
+        unknown = [k for k in list(filters) + list(columns or []) if k not in self.schema['columns']]
+        if unknown:
+            raise KeyError('unknown columns %s' % unknown)
+        columns = list(self.schema['columns']) if columns is None else list(columns)
+        if 'run_id' not in columns:
+            columns.append('run_id')
+
+        for attempt in range(3):
+            try:
+                parts = [self._query_segment(s, columns, filters) for s in self.segments()]
+                break
+            except FileNotFoundError: # a concurrent compact() removed a segment
+                self._cache.clear()
+        else:
+            raise RuntimeError('segments of %s kept changing during the query' % self.directory)
+        parts = [p for p in parts if p is not None]
+        if not parts:
+            kinds = self.schema['columns']
+            return {k: np.zeros(0, dtype=_DTYPES[kinds[k]]) for k in columns}
+        return {k: np.concatenate([p[k] for p in parts]) for k in columns}
+
+    def _query_segment(self, segment, columns, filters):
+        # zone map: skip the segment if an index filter cannot match
+        if self.index and filters:
+            lo, hi = self._column(segment, '__min__'), self._column(segment, '__max__')
+            for i, k in enumerate(self.index):
+                if k in filters and not _overlaps(lo[i], hi[i], filters[k]):
+                    return None
+        rows = slice(None)
+        first = self.index[0] if self.index else None
+        if first in filters and isinstance(filters[first], tuple) and self._column(segment, '__sorted__'):
+            # sorted by the first index column: binary search its range
+            a = self._column(segment, first)
+            lo, hi = filters[first]
+            rows = slice(0 if lo is None else np.searchsorted(a, lo, 'left'),
+                         len(a) if hi is None else np.searchsorted(a, hi, 'right'))
+        mask = None
+        for k, cond in filters.items():
+            m = _match(self._column(segment, k)[rows], cond)
+            mask = m if mask is None else mask & m
+        out = {k: self._column(segment, k)[rows] for k in columns}
+        if mask is not None:
+            out = {k: v[mask] for k, v in out.items()}
+        return out
+
+    def traces(self, run_id):
+        """
+        Traces stored with a run, as a dict of arrays ({} if none were stored).
+        """
+        try:
+            with np.load(self._trace_path(run_id)) as data:
+                return {k: data[k] for k in data.files}
+        except FileNotFoundError:
+            return {}
+
+    def __len__(self):
+        return sum(len(self._column(s, 'run_id')) for s in self.segments())
+
+    # -------------------------------------------------------------------------
+    # maintenance
+    # -------------------------------------------------------------------------
+    def compact(self):
+        """
+        Merge all live segments into one, sorted by the index columns. Segments
+        appended meanwhile are kept as they are. Returns False if another
+        compact() holds the lock.
+        """
+        self.flush()
+        lock = os.path.join(self.directory, 'compact.lock')
+        if not _lock(lock, wait=False):
+            return False
+        try:
+            # columns added by other workers since this store was opened must be merged too
+            self.schema = self._read_schema() or self.schema
+            old = self.segments()
+            if len(old) < 2 and (not old or self._column(old[0], '__sorted__')):
+                return True
+            names = list(dict.fromkeys(k for s in old for k in self._files(s)))
+            columns = {k: np.concatenate([self._column(s, k) for s in old]) for k in names}
+            if self.index:
+                order = np.lexsort([columns[k] for k in reversed(self.index)])
+                columns = {k: v[order] for k, v in columns.items()}
+            self._write_segment(columns, replaces=old, sorted_=bool(self.index))
+            for s in old: # readers ignore them from here on
+                os.remove(os.path.join(self._segment_dir, s))
+                self._cache.pop(s, None)
+            return True
+        finally:
+            os.remove(lock)
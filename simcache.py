@@ -0,0 +1,187 @@
+"""
+Content-addressed on-disk cache of simulation results, shared by the HH
+(HH/HH_model.py), pump (Pump/pump_model.py) and HybridCell
+(bSbC_ModelFiles-WienbarSchwartz/HybridCell_Batch.py) drivers.
+
+A result is keyed by the SHA-256 of everything that can change it: model name,
+parameters, protocol, solver settings and the contents of the source files that
+define the model (the model's .py file, and for NEURON cells the .mod files).
+Editing a mechanism or the equations therefore invalidates exactly the affected
+results, while re-running an unchanged configuration is a file read.
+
+Each entry is one .npz file holding the traces (arrays) and a JSON blob of
+extracted features. Writes are atomic (temp file + rename), so concurrent workers
+can share a cache directory. When the directory grows beyond max_bytes the
+least recently used entries are evicted (reads refresh an entry's mtime). The
+size is kept as a running total from the first put() on; the directory is only
+scanned again when that total passes max_bytes.
+
+Features are not part of the key: cached(..., features=f) evaluates f on the
+traces on hits as well as misses, so an entry stored without features (or with
+another feature function) still returns f's features.
+
+example:
+    cache = SimCache('~/.cache/bsbc_sims')
+    key = cache.key('pump', p, protocol, dict(dt=dt, rtol=1e-10), sources=[pump_model.__file__])
+    result = cache.get(key)
+    if result is None:
+        t, y, _ = simulate(protocol, p, dt)
+        result = cache.put(key, dict(t=t, y=y))
+"""
+import os
+import json
+import glob
+import hashlib
+import tempfile
+
+import numpy as np
+
+
+def _canonical(obj):
+    """
+    JSON-able, order-independent form of parameters / protocols. Arrays are
+    replaced by a digest of their bytes so long stimuli stay cheap to key.
+    """
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))}
+    if callable(getattr(obj, 'items', None)): # parameter records such as pump_model.PumpParams
+        return _canonical(dict(obj.items()))
+    if hasattr(obj, '_asdict'): # namedtuples such as the pump_model injectors, tagged with their type
+        return dict(_canonical(obj._asdict()), __type__=type(obj).__name__)
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        a = np.ascontiguousarray(obj)
+        return {'__array__': hashlib.sha256(a.view(np.uint8)).hexdigest(), 'dtype': str(a.dtype), 'shape': a.shape}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _to_json(obj):
+    # json.dumps default= for numpy values in features
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError('%r is not JSON serializable' % type(obj))
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class SimCache:
+    def __init__(self, directory, max_bytes=2 * 1024**3):
+        """
+        Parameters:
+            directory : cache directory (created if missing).
+            max_bytes : size bound; LRU entries beyond it are evicted on put().
+        """
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self._size = None # running total of the entry sizes, None until first needed
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, model, params, protocol=None, solver=None, sources=()):
+        """
+        Hex digest identifying a simulation. sources are paths of files whose
+        contents define the model (e.g. the .py and .mod files).
+        """
+        blob = json.dumps(dict(model=model, params=_canonical(params), protocol=_canonical(protocol),
+                               solver=_canonical(solver),
+                               sources=sorted(file_digest(s) for s in sources)), sort_keys=True)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+    def get(self, key):
+        """
+        Cached result as a dict of arrays plus 'features' (dict), or None.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                result = {k: data[k] for k in data.files if k != '__features__'}
+                result['features'] = json.loads(str(data['__features__']))
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        os.utime(path) # mark as recently used
+        self.hits += 1
+        return result
+
+    def put(self, key, traces, features=None):
+        """
+        Store traces (dict name -> array) and features (JSON-able dict); returns
+        the stored result in the same form as get().
+        """
+        features = {} if features is None else features
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self._size is None:
+            self._size = self.size()
+        try:
+            self._size -= os.path.getsize(path) # overwritten
+        except OSError:
+            pass
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, __features__=json.dumps(features, default=_to_json), **traces)
+        self._size += os.path.getsize(tmp)
+        os.replace(tmp, path)
+        if self._size > self.max_bytes:
+            self.evict()
+        return dict(traces, features=features)
+
+    def cached(self, key, compute, features=None):
+        """
+        get(key), or compute() -> traces (dict of arrays) and put() on a miss.
+        features(traces) -> dict is evaluated on the traces either way (and
+        stored on a miss), so the returned features never come from a different
+        feature function.
+        """
+        result = self.get(key)
+        if result is None:
+            traces = compute()
+            return self.put(key, traces, None if features is None else features(traces))
+        if features is not None:
+            result['features'] = json.loads(json.dumps(features(result), default=_to_json))
+        return result
+
+    def entries(self):
+        return glob.glob(os.path.join(self.directory, '??', '*.npz'))
+
+    def size(self):
+        return sum(os.path.getsize(p) for p in self.entries())
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+        """
+        files = []
+        for p in self.entries():
+            try:
+                st = os.stat(p)
+            except FileNotFoundError: # removed by another process
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        total = sum(f[1] for f in files)
+        for mtime, size, p in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(p)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+    def stats(self):
+        n = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, hit_rate=self.hits / n if n else 0.0,
+                    evictions=self.evictions, entries=len(self.entries()), bytes=self.size())